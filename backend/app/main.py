@@ -1,8 +1,16 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 import sys
 import os
+import json
+import asyncio
+import hmac
+import tempfile
+import time
 from pathlib import Path
 from typing import List, Optional, Dict
 from datetime import datetime
@@ -54,13 +62,26 @@ app.add_middleware(
     allow_headers=["Content-Type", "Authorization", "Accept"],
 )
 
-# Initialize the RAG system with error handling
-try:
-    rag = LegalRAG()
-    print("RAG system initialized successfully")
-except Exception as e:
-    print(f"Error initializing RAG system: {e}")
-    rag = None
+# The RAG system is loaded by a background task after startup, so the server accepts
+# connections at once; until it is ready, chat requests get a fast 503 with Retry-After.
+# A failed load is retried every STARTUP_RETRY_SECONDS.
+rag = None
+STARTUP_RETRY_SECONDS = float(os.getenv("STARTUP_RETRY_SECONDS", "30"))
+RETRY_AFTER_SECONDS = 5
+
+# Hot reload: POST /api/admin/reload (with an X-Admin-Token header matching ADMIN_TOKEN)
+# or a knowledge-base change noticed every RELOAD_CHECK_INTERVAL seconds (0 disables)
+# builds a new LegalRAG in a worker thread and swaps it in. Requests keep the instance
+# they started with, so in-flight requests finish on the old index.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+RELOAD_CHECK_INTERVAL = float(os.getenv("RELOAD_CHECK_INTERVAL", "0"))
+reload_lock = asyncio.Lock()
+reload_state = {"status": "idle", "reason": None, "started_at": None, "seconds": None, "error": None}
+
+# An admin reload request rewrites RELOAD_MARKER; every worker process on the machine
+# polls it every RELOAD_MARKER_INTERVAL seconds and reloads when it changes
+RELOAD_MARKER = os.getenv("RELOAD_MARKER", os.path.join(tempfile.gettempdir(), "legal_rag_reload_request"))
+RELOAD_MARKER_INTERVAL = float(os.getenv("RELOAD_MARKER_INTERVAL", "2"))
 
 # Models
 class Message(BaseModel):
@@ -84,6 +105,7 @@ class MessageResponse(BaseModel):
     conversation_id: str
     message: Message
     sources: List[str] = []
+    prompt_tokens: Optional[int] = None
 
 class UserProfile(BaseModel):
     id: str
@@ -91,12 +113,160 @@ class UserProfile(BaseModel):
     name: Optional[str] = None
     picture: Optional[str] = None
 
+def build_rag():
+    """Build a LegalRAG ready to serve, reusing the current one's clients and caches"""
+    if rag is not None:
+        return rag.reload()
+    return LegalRAG().warm_up()
+
+async def reload_rag(reason: str):
+    """Build a new RAG system off the request path and swap it in"""
+    global rag
+    if reload_lock.locked():
+        return
+    async with reload_lock:
+        reload_state.update(status="reloading", reason=reason, started_at=datetime.now(), seconds=None, error=None)
+        start = time.perf_counter()
+        try:
+            new_rag = await run_in_threadpool(build_rag)
+        except Exception as e:
+            print(f"Error reloading RAG system: {e}")
+            reload_state.update(status="failed", error=str(e), seconds=time.perf_counter() - start)
+            return
+        
+        # A single reference swap; requests holding the old instance are unaffected
+        rag = new_rag
+        reload_state.update(status="idle", seconds=time.perf_counter() - start)
+        print(f"Loaded RAG system ({reason}): index {rag.index_version} in {reload_state['seconds']:.1f}s")
+
+async def load_rag_in_background():
+    """Load the RAG system after startup, retrying until it succeeds"""
+    while rag is None:
+        await reload_rag("startup")
+        if rag is None:
+            await asyncio.sleep(STARTUP_RETRY_SECONDS)
+
+async def watch_knowledge_base():
+    """Reload whenever the knowledge base or prebuilt index changes"""
+    failed_version = None
+    while True:
+        await asyncio.sleep(RELOAD_CHECK_INTERVAL)
+        if rag is None or reload_lock.locked():
+            continue
+        version = await run_in_threadpool(rag.knowledge_base_version)
+        if version is None or version == rag.knowledge_version or version == failed_version:
+            continue
+        await reload_rag("knowledge base changed")
+        # Do not retry a failed version every interval; the next change triggers again
+        failed_version = version if reload_state["status"] == "failed" else None
+
+def read_reload_marker():
+    """Contents of the reload marker, or None if no reload was ever requested"""
+    try:
+        with open(RELOAD_MARKER) as f:
+            return f.read()
+    except OSError:
+        return None
+
+def request_reload():
+    """Ask every worker to reload by rewriting the reload marker"""
+    temp_path = f"{RELOAD_MARKER}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(f"{time.time_ns()} {os.getpid()}")
+    os.replace(temp_path, RELOAD_MARKER)
+
+async def watch_reload_requests():
+    """Reload whenever any worker has received an admin reload request"""
+    seen = read_reload_marker()
+    while True:
+        await asyncio.sleep(RELOAD_MARKER_INTERVAL)
+        marker = await run_in_threadpool(read_reload_marker)
+        # While a load is running, the request is handled once it has finished
+        if marker == seen or rag is None or reload_lock.locked():
+            continue
+        seen = marker
+        await reload_rag("admin request")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # A gunicorn master with preload_app may already have loaded the RAG system
+    if rag is None:
+        app.state.load_task = asyncio.create_task(load_rag_in_background())
+    if RELOAD_CHECK_INTERVAL > 0:
+        app.state.watch_task = asyncio.create_task(watch_knowledge_base())
+    if ADMIN_TOKEN:
+        app.state.reload_requests_task = asyncio.create_task(watch_reload_requests())
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Allow admin endpoints only with the configured ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def require_rag():
+    """The current RAG system, or a fast 503 while it is not ready"""
+    current_rag = rag
+    if current_rag is None:
+        detail = "RAG system is starting, please retry shortly"
+        if reload_state["status"] == "failed":
+            detail = "RAG system is not available. Please check server logs."
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    return current_rag
+
 @app.get("/")
 async def read_root():
     if rag is None:
-        return {"message": "Polish Law for Foreigners Chat API is running, but RAG system failed to initialize"}
+        return {"message": "Polish Law for Foreigners Chat API is running, but the RAG system is not ready yet"}
     return {"message": "Polish Law for Foreigners Chat API is running"}
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the server is up, whether or not the RAG system is loaded"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the retrieval index is loaded, with load-stage timings"""
+    current_rag = rag
+    if current_rag is None:
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            content=jsonable_encoder({
+                "status": "failed" if reload_state["status"] == "failed" else "starting",
+                "started_at": reload_state["started_at"],
+                "error": reload_state["error"]
+            })
+        )
+    return {
+        "status": "ready",
+        "index_version": current_rag.index_version,
+        "documents": len(current_rag.documents),
+        "load_seconds": reload_state["seconds"],
+        "load_timings": current_rag.load_timings
+    }
+
+@app.get("/api/stats", dependencies=[Depends(verify_admin_token)])
+async def get_stats():
+    """Retrieval index and cache statistics"""
+    return require_rag().stats()
+
+@app.post("/api/admin/reload", status_code=202, dependencies=[Depends(verify_admin_token)])
+async def reload_knowledge_base():
+    """Have every worker rebuild the RAG system from the current knowledge base in the background"""
+    await run_in_threadpool(request_reload)
+    return {"status": "reload requested", "within_seconds": RELOAD_MARKER_INTERVAL}
+
+@app.get("/api/admin/reload", dependencies=[Depends(verify_admin_token)])
+async def get_reload_status():
+    """State of the last knowledge-base reload and the index served by the worker that answers"""
+    return {
+        **reload_state,
+        "index_version": rag.index_version if rag is not None else None,
+        "worker_pid": os.getpid()
+    }
+
 @app.get("/api/me", response_model=UserProfile)
 async def get_user_profile(user: User = Depends(get_current_user)):
     """Get the current user's profile"""
@@ -122,72 +292,130 @@ async def get_conversation_endpoint(conversation_id: str, user: User = Depends(g
     
     return conversation
 
+async def start_conversation_turn(user_id: str, conversation_id: Optional[str], content: str):
+    """Load or create a conversation and append the user's message to it"""
+    conversation = None
+    
+    if conversation_id:
+        conversation = await run_in_threadpool(get_conversation, user_id, conversation_id)
+    
+    if not conversation:
+        # Create new conversation
+        conversation_id = str(uuid.uuid4())
+        conversation = Conversation(id=conversation_id, user_id=user_id).dict()
+    
+    # Add user message to conversation
+    user_message = Message(role="user", content=content)
+    
+    if not conversation.get('messages'):
+        conversation['messages'] = []
+        
+    conversation['messages'].append(user_message.dict())
+    return conversation_id, conversation
+
+async def finish_conversation_turn(user_id: str, conversation_id: str, conversation: Dict, answer: str) -> Message:
+    """Append the assistant's answer to the conversation and save it"""
+    assistant_message = Message(
+        role="assistant", 
+        content=answer
+    )
+    
+    # Add to conversation
+    conversation['messages'].append(assistant_message.dict())
+    
+    # Update conversation timestamp
+    conversation['updated_at'] = datetime.now().isoformat()
+    
+    # Save conversation
+    await run_in_threadpool(save_conversation, user_id, conversation_id, conversation)
+    return assistant_message
+
+def sse_event(event: str, data: Dict) -> str:
+    """Format a Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
 @app.post("/api/chat", response_model=MessageResponse)
 async def send_message(request: MessageRequest, user: Optional[User] = Depends(get_optional_user)):
     """Send a message and get a response"""
+    # Keep using this instance for the whole request, even if a reload swaps it
+    current_rag = require_rag()
     try:
-        if rag is None:
-            raise HTTPException(status_code=500, detail="RAG system is not available. Please check server logs.")
-            
         user_id = user.id if user else "anonymous"
         
         # Get or create conversation
-        conversation_id = request.conversation_id
-        conversation = None
-        
-        if conversation_id:
-            conversation = get_conversation(user_id, conversation_id)
-        
-        if not conversation:
-            # Create new conversation
-            conversation_id = str(uuid.uuid4())
-            conversation = Conversation(id=conversation_id, user_id=user_id)
-        
-        # Add user message to conversation
-        user_message = Message(role="user", content=request.message)
-        
-        if not conversation.get('messages'):
-            conversation['messages'] = []
-            
-        conversation['messages'].append(user_message.dict())
-        
-        # Build conversation history for context
-        messages = conversation.get('messages', [])
-        conversation_history = "\n".join([
-            f"{msg['role']}: {msg['content']}" 
-            for msg in messages[-10:]  # Get last 10 messages for context
-        ])
-        
-        # Generate response using RAG with conversation context
-        result = rag.generate_response(
-            f"Conversation history:\n{conversation_history}\n\nCurrent question: {request.message}"
-        )
-        
-        # Create assistant message
-        assistant_message = Message(
-            role="assistant", 
-            content=result["answer"]
+        conversation_id, conversation = await start_conversation_turn(
+            user_id, request.conversation_id, request.message
         )
         
-        # Add to conversation
-        conversation['messages'].append(assistant_message.dict())
+        # Generate response using RAG; earlier messages are passed as chat history
+        result = await current_rag.agenerate_response(request.message, conversation['messages'][:-1])
         
-        # Update conversation timestamp
-        conversation['updated_at'] = datetime.now().isoformat()
-        
-        # Save conversation
-        save_conversation(user_id, conversation_id, conversation)
+        assistant_message = await finish_conversation_turn(
+            user_id, conversation_id, conversation, result["answer"]
+        )
         
         return {
             "conversation_id": conversation_id,
             "message": assistant_message,
-            "sources": result.get("sources", [])
+            "sources": result.get("sources", []),
+            "prompt_tokens": result.get("prompt_tokens")
         }
         
     except Exception as e:
         print(f"Error processing message: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing your message: {str(e)}")
 
+@app.post("/api/chat/stream")
+async def stream_message(request: MessageRequest, user: Optional[User] = Depends(get_optional_user)):
+    """Send a message and stream the response as Server-Sent Events.
+
+    Emits a `sources` event as soon as retrieval is done, one `token` event per
+    generated text chunk, and a final `done` event with the saved message. If
+    generation fails, the stream ends with an `error` event instead and the
+    partial answer is not saved.
+    """
+    current_rag = require_rag()
+    
+    user_id = user.id if user else "anonymous"
+    conversation_id, conversation = await start_conversation_turn(
+        user_id, request.conversation_id, request.message
+    )
+    history = conversation['messages'][:-1]
+    
+    async def event_stream():
+        sources = []
+        prompt_tokens = None
+        answer_parts = []
+        
+        async for event in current_rag.astream_response(request.message, history):
+            if event['type'] == 'sources':
+                sources = event['sources']
+                prompt_tokens = event.get('prompt_tokens')
+                yield sse_event("sources", {"conversation_id": conversation_id, "sources": sources})
+            elif event['type'] == 'error':
+                yield sse_event("error", {"conversation_id": conversation_id, "message": event['message']})
+                return
+            else:
+                answer_parts.append(event['content'])
+                yield sse_event("token", {"content": event['content']})
+        
+        # Persist the assembled answer once generation has completed
+        assistant_message = await finish_conversation_turn(
+            user_id, conversation_id, conversation, "".join(answer_parts)
+        )
+        yield sse_event("done", {
+            "conversation_id": conversation_id,
+            "message": assistant_message,
+            "sources": sources,
+            "prompt_tokens": prompt_tokens
+        })
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.delete("/api/conversations/{conversation_id}")
 async def delete_conversation_endpoint(conversation_id: str, user: User = Depends(get_current_user)):
     """Delete a conversation"""
@@ -51,6 +51,15 @@ for file in ../query/*.xlsx; do
     fi
 done
 
+# Build the retrieval index so instances don't embed documents at startup
+echo "Building retrieval index..."
+# (needs the build dependencies: pip install -r requirements-build.txt)
+WITH_XLSX=false
+if ! (cd .. && python -m query.build_index --upload); then
+    echo -e "${RED}Index build failed; instances will build it in memory${NC}"
+    WITH_XLSX=true
+fi
+
 # Create a temporary build directory
 echo "Creating temporary build directory..."
 BUILD_DIR=$(mktemp -d)
@@ -60,8 +69,12 @@ echo "Build directory: $BUILD_DIR"
 echo "Copying backend files..."
 cp -r app/ $BUILD_DIR/app/
 cp run.py $BUILD_DIR/
-cp requirements.txt $BUILD_DIR/
+cp requirements.txt requirements-build.txt gunicorn.conf.py $BUILD_DIR/
 cp Dockerfile $BUILD_DIR/
+# Without a prebuilt index the image needs pandas/openpyxl to read the xlsx
+if [ "$WITH_XLSX" = "true" ]; then
+    sed -i 's/^ARG WITH_XLSX=false/ARG WITH_XLSX=true/' $BUILD_DIR/Dockerfile
+fi
 cp .dockerignore $BUILD_DIR/
 
 # Create query directory in build directory
@@ -80,6 +93,7 @@ for file in ../query/*.xlsx; do
         cp "$file" $BUILD_DIR/query/
     fi
 done
+cp ../query/data/retrieval_index.bin $BUILD_DIR/query/data/ 2>/dev/null || true
 
 # Move to build directory
 cd $BUILD_DIR
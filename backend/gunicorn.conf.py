@@ -0,0 +1,52 @@
+"""Gunicorn settings for serving the API on every core of a node.
+
+Usage: gunicorn -c gunicorn.conf.py app.main:app
+
+With preload_app, the app is imported once in the master process before the
+uvicorn workers are forked. If a prebuilt retrieval index exists, the workers
+start serving at once (503 with Retry-After until ready) and each loads it in
+the background; the artifact is memory-mapped read-only, so its pages are
+shared through the page cache. Without one, the index has to be built in
+memory, so the master builds it (see when_ready) and the workers share it
+copy-on-write. Either way, adding workers does not multiply index RAM.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = os.getenv('PRELOAD_APP', 'true').lower() == 'true'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+
+def when_ready(server):
+    """Build an in-memory RAG system before forking, then freeze the heap.
+
+    With a prebuilt index, or if loading fails here, each worker loads the
+    RAG system in the background instead.
+    """
+    if not preload_app:
+        return
+    from app import main
+    from query.prepare_rag import RAG_INDEX_PATH
+
+    if os.path.exists(RAG_INDEX_PATH):
+        server.log.info(f"Workers will load the prebuilt index {RAG_INDEX_PATH} in the background")
+    else:
+        try:
+            main.rag = main.build_rag()
+        except Exception as e:
+            server.log.error(f"Preloading the RAG system failed; workers will load it: {e}")
+    # Keep the garbage collector from writing to (and so copying) the preloaded objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    from app import main
+
+    if main.rag is not None:
+        main.rag.after_fork()
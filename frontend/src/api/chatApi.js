@@ -49,6 +49,88 @@ const chatApi = {
     }
   },
 
+  // Send a message and stream the response as Server-Sent Events.
+  // Callbacks: onSources(sources, conversationId), onToken(text), onDone(data).
+  // Resolves with the same shape as sendMessage once the stream completes, and
+  // rejects if the backend reports an error (tokens received so far are partial).
+  streamMessage: async (message, conversationId = null, { onSources, onToken, onDone } = {}) => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/chat/stream`, {
+        method: 'POST',
+        headers: {
+          ...DEFAULT_HEADERS,
+          'Accept': 'text/event-stream',
+          ...getAuthHeaders(),
+        },
+        body: JSON.stringify({
+          message,
+          conversation_id: conversationId,
+        }),
+      });
+
+      if (!response.ok || !response.body) {
+        console.warn(`Cloud Run backend stream failed with status: ${response.status}`);
+        throw new Error(`Backend error: ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let result = null;
+      let streamError = null;
+
+      const handleEvent = (rawEvent) => {
+        let event = 'message';
+        const dataLines = [];
+        rawEvent.split('\n').forEach((line) => {
+          if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+          } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+          }
+        });
+        if (dataLines.length === 0) return;
+
+        const data = JSON.parse(dataLines.join('\n'));
+        if (event === 'sources' && onSources) {
+          onSources(data.sources, data.conversation_id);
+        } else if (event === 'token' && onToken) {
+          onToken(data.content);
+        } else if (event === 'error') {
+          streamError = new Error(data.message || 'Error generating the response');
+        } else if (event === 'done') {
+          result = data;
+          if (onDone) onDone(data);
+        }
+      };
+
+      // eslint-disable-next-line no-constant-condition
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        events.forEach(handleEvent);
+      }
+      if (buffer.trim()) {
+        handleEvent(buffer);
+      }
+
+      if (streamError) {
+        throw streamError;
+      }
+      if (!result) {
+        throw new Error('Stream ended before the response was complete');
+      }
+      return result;
+    } catch (error) {
+      console.error('Error streaming message from Cloud Run backend:', error);
+      throw error;
+    }
+  },
+
 
   // Get all conversations for the user
   getConversations: async () => {
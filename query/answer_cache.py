@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+
+
+class CachedAnswer:
+    __slots__ = ('vector', 'doc_ids', 'answer', 'sources', 'latency')
+
+    def __init__(self, vector, doc_ids, answer, sources, latency):
+        self.vector = vector
+        self.doc_ids = doc_ids
+        self.answer = answer
+        self.sources = sources
+        self.latency = latency
+
+
+class SemanticAnswerCache:
+    """LRU cache of generated answers, matched by question similarity.
+
+    A lookup hits when a cached question's embedding has cosine similarity of
+    at least `threshold` with the new one *and* retrieval returned the same
+    documents, so the LLM would have seen exactly the same context. Entries are
+    bound to an index version and dropped as soon as a different version is
+    seen. `max_size=0` disables the cache.
+    """
+
+    def __init__(self, threshold=0.95, max_size=512):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.index_version = None
+        self.ids = count()
+        self.lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.seconds_saved = 0.0
+
+    @staticmethod
+    def _unit(vector):
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def _check_version(self, index_version):
+        if index_version != self.index_version:
+            self.entries.clear()
+            self.index_version = index_version
+
+    def lookup(self, query_vector, doc_ids, index_version):
+        """Return the CachedAnswer for a near-duplicate question, or None."""
+        if self.max_size <= 0:
+            return None
+        vector = self._unit(query_vector)
+        if vector is None:
+            return None
+        doc_ids = tuple(doc_ids)
+
+        with self.lock:
+            self._check_version(index_version)
+            self.lookups += 1
+
+            candidates = [(key, entry) for key, entry in self.entries.items() if entry.doc_ids == doc_ids]
+            if not candidates:
+                return None
+
+            similarities = np.stack([entry.vector for _, entry in candidates]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            key, entry = candidates[best]
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.seconds_saved += entry.latency
+            return entry
+
+    def store(self, query_vector, doc_ids, answer, sources, latency, index_version):
+        """Cache a freshly generated answer together with how long it took."""
+        if self.max_size <= 0:
+            return
+        vector = self._unit(query_vector)
+        if vector is None:
+            return
+
+        with self.lock:
+            self._check_version(index_version)
+            self.entries[next(self.ids)] = CachedAnswer(vector, tuple(doc_ids), answer, list(sources), latency)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'seconds_saved': round(self.seconds_saved, 3),
+        }
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import struct
+from datetime import datetime, timezone
+
+import numpy as np
+
+from .embedding_store import atomic_write
+
+# File layout: MAGIC | uint64 header length | JSON header | padding | arrays.
+# Every array starts on an ALIGNMENT boundary so it can be memory-mapped in place.
+MAGIC = b'LRAGIDX1'
+ALIGNMENT = 64
+# Version 2 stores the documents as columns (document_store.encode_documents)
+# instead of JSON in the header; older artifacts must be rebuilt
+ARTIFACT_FORMAT_VERSION = 2
+
+# Prefix of the document column arrays
+DOCUMENT_ARRAY_PREFIX = 'doc_'
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_container(path, metadata, arrays, magic=MAGIC):
+    """Atomically write a JSON-serializable `metadata` dict and named arrays to `path`."""
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # The header stores array offsets relative to the (aligned) data section
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        layout[name] = {'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str}
+        offset += array.nbytes
+
+    header = json.dumps({**metadata, 'arrays': layout}, default=str).encode('utf-8')
+    data_start = _aligned(len(magic) + 8 + len(header))
+
+    def write(f):
+        f.write(magic)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(b'\0' * (data_start + layout[name]['offset'] - f.tell()))
+            f.write(array.tobytes())
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    atomic_write(path, write)
+
+
+def read_container(path, magic=MAGIC):
+    """Read the metadata of a file written by write_container and memory-map its arrays read-only."""
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f"{path} is not a {magic.decode()} file")
+        (header_length,) = struct.unpack('<Q', f.read(8))
+        metadata = json.loads(f.read(header_length))
+
+    data_start = _aligned(len(magic) + 8 + header_length)
+    arrays = {}
+    for name, spec in metadata.pop('arrays').items():
+        shape = tuple(spec['shape'])
+        if 0 in shape:
+            arrays[name] = np.empty(shape, dtype=spec['dtype'])
+        else:
+            arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r',
+                                     offset=data_start + spec['offset'], shape=shape)
+    return metadata, arrays
+
+
+class RetrievalArtifact:
+    """Self-describing retrieval index: documents, vectors and build metadata in one file.
+
+    `metadata` is a JSON-serializable dict (model name, source-file hash,
+    document count, ...). `arrays` maps names to NumPy arrays: `vectors`, the
+    L2-normalized float32 document embedding matrix, and the `doc_*` document
+    columns are always present.
+    Optional arrays include `question_vectors` for the FAQ fast path, the
+    index data of other vector index backends (`ivf_*`, `int8_*`, `pq_*`) and
+    the `pca_*` projection of a PCA-reduced index.
+    Loaded arrays are read-only memory maps into the artifact file.
+    """
+
+    def __init__(self, metadata, arrays):
+        self.metadata = metadata
+        self.arrays = arrays
+        self._documents = None
+
+    @property
+    def documents(self):
+        """The documents as compact document_store.Document records, decoded on first use."""
+        if self._documents is None:
+            # Imported here: document_store builds on this module's container format
+            from .document_store import decode_documents
+            self._documents = decode_documents(self.arrays, DOCUMENT_ARRAY_PREFIX)
+        return self._documents
+
+    @property
+    def vectors(self):
+        return self.arrays['vectors']
+
+    @property
+    def version(self):
+        return self.metadata.get('version')
+
+    @property
+    def dimensions(self):
+        return self.vectors.shape[1]
+
+    @property
+    def model(self):
+        return self.metadata.get('model')
+
+    @property
+    def source_sha256(self):
+        return self.metadata.get('source_sha256')
+
+    @classmethod
+    def create(cls, documents, vectors, model, source_sha256, arrays=None, **extra):
+        from .document_store import encode_documents
+
+        created_at = datetime.now(timezone.utc)
+        metadata = {
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'version': f"{created_at:%Y%m%d%H%M%S}-{(source_sha256 or 'unknown')[:8]}",
+            'created_at': created_at.isoformat(),
+            'model': model,
+            'source_sha256': source_sha256,
+            'document_count': len(documents),
+            **extra,
+        }
+        arrays = {
+            **encode_documents(documents, DOCUMENT_ARRAY_PREFIX),
+            **{name: np.asarray(array) for name, array in (arrays or {}).items()},
+        }
+        return cls(metadata, {'vectors': np.asarray(vectors, dtype=np.float32), **arrays})
+
+    def save(self, path):
+        """Write the artifact atomically to `path`."""
+        write_container(path, self.metadata, self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Read the header and memory-map every array read-only."""
+        metadata, arrays = read_container(path)
+        if metadata.get('format_version') != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported artifact format version {metadata.get('format_version')}")
+        return cls(metadata, arrays)
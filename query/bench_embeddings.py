@@ -0,0 +1,47 @@
+"""Compare per-text and batched embedding requests against a local fake OpenAI server.
+
+Usage: python -m query.bench_embeddings [--count 500] [--latency 0.05]
+
+The fake server lives in query/fake_openai.py.
+"""
+import argparse
+import time
+
+from openai import OpenAI
+
+from .embeddings import EMBEDDING_MODEL, embed_texts
+from .fake_openai import start_fake_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=500, help='number of texts to embed')
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated seconds per request')
+    args = parser.parse_args()
+
+    server = start_fake_server(args.latency)
+    client = OpenAI(api_key='fake-key', base_url=f"http://127.0.0.1:{server.server_port}/v1")
+    texts = [f"Question: sample question {i}\nAnswer: " + "Przykładowa odpowiedź. " * 40
+             for i in range(args.count)]
+
+    start = time.perf_counter()
+    one_by_one = [client.embeddings.create(model=EMBEDDING_MODEL, input=text).data[0].embedding
+                  for text in texts]
+    sequential_time = time.perf_counter() - start
+    sequential_requests = server.request_count
+
+    server.request_count = 0
+    start = time.perf_counter()
+    batched = embed_texts(client, texts)
+    batched_time = time.perf_counter() - start
+
+    server.shutdown()
+
+    print(f"Texts embedded:  {len(texts)}")
+    print(f"Per-text:        {sequential_requests} requests, {sequential_time:.2f}s")
+    print(f"Batched:         {server.request_count} requests, {batched_time:.2f}s")
+    print(f"Order preserved: {batched == one_by_one}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Recall, latency and memory of the approximate vector indexes compared with brute force.
+
+Usage: python -m query.bench_index [--count 100000] [--dimensions 256] [--nprobe 1 2 4 8 16 32]
+       python -m query.bench_index --artifact query/data/retrieval_index.bin
+
+IVF is measured for each --nprobe value, int8 and PQ for each --rerank value.
+
+Without --artifact the corpus is synthetic: clustered random unit vectors,
+queried with noisy copies of corpus rows. With --artifact the document vectors
+of a built retrieval index are used instead.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from .artifact import RetrievalArtifact
+from .vector_index import BruteForceIndex, Int8Index, IVFIndex, PQIndex, default_nlist, normalize_rows
+
+
+def synthetic_vectors(count, dimensions, clusters, rng):
+    """Unit vectors scattered around `clusters` random topic directions."""
+    topics = rng.standard_normal((clusters, dimensions), dtype=np.float32)
+    vectors = topics[rng.integers(clusters, size=count)]
+    vectors += 0.6 * rng.standard_normal((count, dimensions), dtype=np.float32)
+    return normalize_rows(vectors)
+
+
+def timed_search(index, queries, top_k, **kwargs):
+    """Result ids for every query and the mean latency in milliseconds."""
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        ids, _ = index.search(query, top_k, **kwargs)
+        results.append(ids)
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def recall(results, expected):
+    """Fraction of the exact top-k ids that the approximate search also returned."""
+    found = sum(len(np.intersect1d(got, want)) for got, want in zip(results, expected))
+    return found / sum(len(want) for want in expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--artifact', help='retrieval index artifact to take document vectors from')
+    parser.add_argument('--count', type=int, default=100000, help='synthetic corpus size')
+    parser.add_argument('--dimensions', type=int, default=256, help='synthetic vector dimensions')
+    parser.add_argument('--queries', type=int, default=200, help='number of queries')
+    parser.add_argument('--top-k', type=int, default=10, help='results per query')
+    parser.add_argument('--nlist', type=int, help='IVF clusters (default: about 4 * sqrt(count))')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='IVF lists probed per query')
+    parser.add_argument('--rerank', type=int, nargs='+', default=[10, 50, 200],
+                        help='int8/PQ candidates reranked with full vectors')
+    parser.add_argument('--subspaces', type=int, help='PQ subspaces (default: dimensions / 4)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.artifact:
+        vectors = np.asarray(RetrievalArtifact.load(args.artifact).vectors)
+    else:
+        vectors = synthetic_vectors(args.count, args.dimensions, max(1, args.count // 500), rng)
+    sources = vectors[rng.integers(len(vectors), size=args.queries)]
+    queries = normalize_rows(sources + 0.5 * rng.standard_normal(sources.shape, dtype=np.float32)
+                             / np.sqrt(vectors.shape[1]))
+
+    exact = BruteForceIndex.from_normalized(vectors)
+    # One untimed pass first, so the baseline is measured warm like every other row
+    timed_search(exact, queries, args.top_k)
+    expected, exact_ms = timed_search(exact, queries, args.top_k)
+    print(f"Vectors: {len(vectors)} x {vectors.shape[1]}, recall@{args.top_k}")
+    print(f"{'index':<20} {'recall':>6} {'ms/query':>9} {'speedup':>8} {'bytes/doc':>10} {'build s':>8}")
+
+    def report(name, index, build_time, measured=None, **kwargs):
+        results, ms = measured or timed_search(index, queries, args.top_k, **kwargs)
+        print(f"{name:<20} {recall(results, expected):6.3f} {ms:9.3f} {exact_ms / ms:7.1f}x "
+              f"{index.memory_bytes / len(index):10.1f} {build_time:8.2f}")
+
+    report('brute force', exact, 0.0, measured=(expected, exact_ms))
+
+    def timed_build(build):
+        start = time.perf_counter()
+        index = build()
+        return index, time.perf_counter() - start
+
+    ivf, build_time = timed_build(lambda: IVFIndex.from_normalized(
+        vectors, nlist=args.nlist or default_nlist(len(vectors))))
+    for nprobe in args.nprobe:
+        report(f'ivf nprobe={nprobe}', ivf, build_time, nprobe=nprobe)
+
+    int8, build_time = timed_build(lambda: Int8Index.from_normalized(vectors))
+    for rerank in args.rerank:
+        report(f'int8 rerank={rerank}', int8, build_time, rerank=rerank)
+
+    pq, build_time = timed_build(lambda: PQIndex.from_normalized(vectors, subspaces=args.subspaces))
+    for rerank in args.rerank:
+        report(f'pq rerank={rerank}', pq, build_time, rerank=rerank)
+
+
+if __name__ == "__main__":
+    main()
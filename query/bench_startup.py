@@ -0,0 +1,88 @@
+"""Measure serving startup: import time, LegalRAG load time and first-request latency.
+
+Usage: python -m query.bench_startup [--runs 3] [--artifact PATH] [--latency 0.05]
+
+Every run starts a fresh interpreter, so import costs are not hidden by
+modules that are already loaded. Requests go to a local fake OpenAI server
+(query/fake_openai.py). The report lists which heavy build-time libraries
+(pandas, openpyxl, scikit-learn) the serving path imported; with a usable
+prebuilt index it should be none.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from .fake_openai import start_fake_server
+
+HEAVY_MODULES = ('pandas', 'openpyxl', 'sklearn')
+
+# Runs in the child interpreter; nothing from the query package is imported before it starts timing
+CHILD_SCRIPT = f'''
+import json, sys, time
+start = time.perf_counter()
+from query.prepare_rag import LegalRAG
+imported = time.perf_counter()
+rag = LegalRAG()
+loaded = time.perf_counter()
+rag.generate_response("Jak uzyskać numer PESEL?")
+first = time.perf_counter()
+rag.generate_response("Jak przedłużyć wizę krajową?")
+second = time.perf_counter()
+print(json.dumps({{
+    'import': imported - start,
+    'load': loaded - imported,
+    'first_request': first - loaded,
+    'second_request': second - first,
+    'index_version': rag.index_version,
+    'heavy_modules': [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+}}))
+'''
+
+PHASES = ('import', 'load', 'first_request', 'second_request')
+
+
+def run_once(env):
+    """Time one cold start in a fresh interpreter; returns the child's measurements."""
+    result = subprocess.run([sys.executable, '-c', CHILD_SCRIPT], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark child failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help='cold starts to measure')
+    parser.add_argument('--artifact', help='prebuilt retrieval index (default: RAG_INDEX_PATH)')
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated seconds per OpenAI request')
+    args = parser.parse_args()
+
+    server = start_fake_server(args.latency)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {
+        **os.environ,
+        'OPENAI_API_KEY': 'fake-key',
+        'OPENAI_BASE_URL': f"http://127.0.0.1:{server.server_port}/v1",
+        'USE_GCS': 'false',
+        'EMBEDDINGS_DIR': os.environ.get('EMBEDDINGS_DIR', tempfile.mkdtemp(prefix='bench_startup_')),
+        'PYTHONPATH': os.pathsep.join(filter(None, [package_root, os.environ.get('PYTHONPATH')])),
+    }
+    if args.artifact:
+        env['RAG_INDEX_PATH'] = os.path.abspath(args.artifact)
+
+    runs = [run_once(env) for _ in range(args.runs)]
+    server.shutdown()
+
+    print(f"Index:          {runs[-1]['index_version']}")
+    print(f"Heavy imports:  {', '.join(runs[-1]['heavy_modules']) or 'none'}")
+    for phase in PHASES:
+        times = [run[phase] * 1000 for run in runs]
+        print(f"{phase + ':':<15} median {statistics.median(times):8.1f} ms   "
+              f"min {min(times):8.1f} ms   max {max(times):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from .vector_index import top_k_indices
+
+# Polish letters that do not decompose under NFKD (ł) are mapped explicitly
+POLISH_FOLDING = str.maketrans('ąćęłńóśźżĄĆĘŁŃÓŚŹŻ', 'acelnoszzACELNOSZZ')
+
+# A crude but cheap stemmer for an inflected language: trailing vowels are
+# dropped and tokens cut to STEM_LENGTH characters ("karta", "kartę", "karty" -> "kart")
+STEM_LENGTH = 6
+VOWELS = 'aeiouy'
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Frequent Polish and English function words, already diacritic-folded
+STOPWORDS = frozenset('''
+    a aby ale bez by byc czy dla do i ich jak jaki jakie jest jestem jesli juz
+    ktora ktore ktory lub ma mam moge moze na nie nim o od oraz po pod przez
+    sa se sie ta tak te tego to tu w we z za ze
+    an and are be can do does for from how i in is it of on or the to what
+    when where which who with you
+'''.split())
+
+
+def fold_diacritics(text):
+    """Lowercase `text` and strip diacritics, so "Zażółć" and "zazolc" match."""
+    text = text.translate(POLISH_FOLDING).casefold()
+    return ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+
+
+def stem(token):
+    stripped = token.rstrip(VOWELS)
+    if len(stripped) >= 3:
+        token = stripped
+    return token[:STEM_LENGTH]
+
+
+def tokenize(text):
+    """Folded, stopword-free, stemmed tokens of `text`."""
+    return [stem(token) for token in TOKEN_PATTERN.findall(fold_diacritics(text)) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of texts, stored as an inverted index.
+
+    Postings are kept in CSR form: the documents containing term `t` are
+    `doc_ids[offsets[t]:offsets[t + 1]]`, and `weights` holds each posting's
+    precomputed BM25 contribution, so a query only sums the weights of its
+    terms' postings.
+    """
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        token_counts = [Counter(tokenize(str(text))) for text in texts]
+        lengths = np.array([sum(counts.values()) for counts in token_counts], dtype=np.float32)
+        average_length = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+
+        postings = {}
+        for doc_id, counts in enumerate(token_counts):
+            for term, frequency in counts.items():
+                postings.setdefault(term, []).append((doc_id, frequency))
+
+        self.vocabulary = {term: position for position, term in enumerate(postings)}
+        self.offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.doc_ids = np.empty(sum(len(entries) for entries in postings.values()), dtype=np.int32)
+        self.weights = np.empty(len(self.doc_ids), dtype=np.float32)
+        self.document_count = len(token_counts)
+
+        position = 0
+        for term, entries in postings.items():
+            docs, frequencies = zip(*entries)
+            docs = np.array(docs, dtype=np.int32)
+            frequencies = np.array(frequencies, dtype=np.float32)
+
+            idf = np.log(1 + (self.document_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = k1 * (1 - b + b * lengths[docs] / average_length)
+            end = position + len(docs)
+            self.doc_ids[position:end] = docs
+            self.weights[position:end] = idf * frequencies * (k1 + 1) / (frequencies + norm)
+            self.offsets[self.vocabulary[term] + 1] = end
+            position = end
+
+    def __len__(self):
+        return self.document_count
+
+    def scores(self, query):
+        """BM25 score of every document for `query`."""
+        scores = np.zeros(self.document_count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            position = self.vocabulary.get(term)
+            if position is not None:
+                start, end = self.offsets[position], self.offsets[position + 1]
+                # A term lists each document at most once, so plain fancy-index += is safe
+                scores[self.doc_ids[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query, top_k=3):
+        """Return `(ids, scores)` of the `top_k` best-matching documents with a positive score."""
+        scores = self.scores(query)
+        best = top_k_indices(scores, top_k)
+        best = best[scores[best] > 0]
+        return best.astype(np.int64), scores[best]
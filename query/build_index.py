@@ -0,0 +1,214 @@
+"""Build the retrieval index artifact offline.
+
+Usage: python -m query.build_index [--source FILE.xlsx] [--output PATH] [--full] [--upload]
+
+Reads the knowledge-base spreadsheet, prepares the documents, embeds them in
+batches and writes a single artifact with the documents, normalized document
+and question vectors, model name and the source file's SHA-256. LegalRAG
+loads this artifact at startup instead of embedding documents on the first
+request.
+
+Builds are incremental: vectors of passages and questions whose content hash
+is unchanged are copied from the existing artifact at `--output` (and from
+the local embedding store), so only new or edited texts are embedded. Texts
+no longer in the knowledge base are dropped from the artifact and the store.
+`--full` ignores the existing artifact, e.g. to refit a PCA projection.
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+from openai import OpenAI
+
+from .artifact import RetrievalArtifact, file_sha256
+from .embedding_store import EmbeddingStore, content_key
+from .embeddings import EMBEDDING_MODEL, embed_texts, embedding_model_id, model_dimensions
+from .knowledge_base import prepare_documents, read_knowledge_base
+from .prepare_rag import (
+    CHUNK_SETTINGS,
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_REDUCTION,
+    EMBEDDINGS_DIR,
+    GCS_BUCKET_NAME,
+    OPENAI_API_KEY,
+    RAG_INDEX_BACKEND,
+    RAG_INDEX_PATH,
+    group_questions,
+    index_params,
+)
+from .reduction import REDUCTION_METHODS, DimensionReducer
+from .vector_index import INDEX_BACKENDS, create_index, normalize_rows
+
+logger = logging.getLogger('legal_rag')
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'legal_questions_answers.xlsx')
+
+
+def embed_with_store(client, texts, model=EMBEDDING_MODEL, store_dir=EMBEDDINGS_DIR, dimensions=None):
+    """Raw embeddings of `texts` as a matrix, reusing and extending the local embedding store."""
+    store = EmbeddingStore.load(store_dir, model=embedding_model_id(model, dimensions))
+    missing = list(dict.fromkeys(text for text in texts if text not in store))
+
+    logger.info(f"Embedding {len(missing)} new texts ({len(texts) - len(missing)} cached)")
+    if missing:
+        store.update(zip(missing, embed_texts(client, missing, model=model, dimensions=dimensions)))
+        store.save(store_dir)
+
+    return np.array([store[text] for text in texts], dtype=np.float32, ndmin=2)
+
+
+def load_previous_artifact(path, model, reducer):
+    """The artifact at `path` if its vectors can be reused for `model` and `reducer`, else None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        artifact = RetrievalArtifact.load(path)
+    except Exception as e:
+        logger.warning(f"Not reusing {path}: {e}")
+        return None
+
+    built_with = DimensionReducer.from_artifact(artifact)
+    if artifact.model != model or built_with.settings() != reducer.settings():
+        logger.info(f"Not reusing {path}: built with {artifact.model} and reduction {built_with.settings()}")
+        return None
+    return artifact
+
+
+def artifact_vectors(artifact):
+    """Index vectors of an artifact's passages and questions, keyed by content hash."""
+    vectors = {content_key(doc['combined_text'], artifact.model): row
+               for doc, row in zip(artifact.documents, artifact.vectors)}
+    if 'question_vectors' in artifact.arrays:
+        questions, _ = group_questions(artifact.documents)
+        vectors.update((content_key(question, artifact.model), row)
+                       for question, row in zip(questions, artifact.arrays['question_vectors']))
+    return vectors
+
+
+def index_vectors(client, texts, known, reducer, model=EMBEDDING_MODEL, store_dir=EMBEDDINGS_DIR):
+    """Normalized index vectors of `texts`; only texts whose hash is not in `known` are embedded.
+
+    Returns `(vectors, embedded)`, where `embedded` counts the texts that
+    were not in `known`. An unfitted PCA reducer is fitted to those texts.
+    """
+    keys = [content_key(text, model) for text in texts]
+    missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in known))
+    if missing:
+        raw_vectors = embed_with_store(client, missing, model, store_dir, reducer.request_dimensions)
+        if not reducer.fitted:
+            reducer.fit(raw_vectors)
+        known = {**known, **dict(zip((content_key(text, model) for text in missing),
+                                     normalize_rows(reducer.transform(raw_vectors))))}
+
+    if not texts:
+        return np.empty((0, reducer.dimensions or model_dimensions(model)), dtype=np.float32), 0
+    return np.array([known[key] for key in keys], dtype=np.float32), len(missing)
+
+
+def prune_store(texts, model=EMBEDDING_MODEL, store_dir=EMBEDDINGS_DIR, dimensions=None):
+    """Drop embeddings of texts that are no longer indexed from the local embedding store."""
+    store = EmbeddingStore.load(store_dir, model=embedding_model_id(model, dimensions))
+    dropped = store.retain(texts)
+    if dropped:
+        store.save(store_dir)
+        logger.info(f"Dropped {dropped} stale embeddings from the embedding store")
+
+
+def build_index(source_path, output_path, model=EMBEDDING_MODEL, client=None,
+                index_backend='flat', dimensions=None, reduction='api', incremental=True,
+                **backend_params):
+    """Build and save the retrieval artifact for `source_path`; returns the artifact.
+
+    With `dimensions`, vectors are reduced to that size as described in
+    DimensionReducer; a PCA projection is fitted to the document vectors and
+    stored in the artifact so queries can be projected the same way.
+
+    With `incremental`, a compatible artifact already at `output_path`
+    provides the vectors (and PCA projection) of unchanged texts. The new
+    artifact replaces it atomically under a new version.
+
+    For an `index_backend` other than 'flat', the trained index data (IVF
+    clusters, int8 or PQ codes) is computed here and stored in the artifact,
+    so servers using the same RAG_INDEX_BACKEND do not train at startup.
+    """
+    if client is None:
+        client = OpenAI(api_key=OPENAI_API_KEY)
+
+    documents = prepare_documents(read_knowledge_base(source_path), **CHUNK_SETTINGS)
+    questions, _ = group_questions(documents)
+    texts = [doc['combined_text'] for doc in documents]
+
+    reducer = DimensionReducer(reduction, dimensions)
+    previous = load_previous_artifact(output_path, model, reducer) if incremental else None
+    known = {}
+    if previous is not None:
+        reducer = DimensionReducer.from_artifact(previous)
+        known = artifact_vectors(previous)
+
+    vectors, embedded = index_vectors(client, texts, known, reducer, model)
+    question_vectors, embedded_questions = index_vectors(client, questions, known, reducer, model)
+    if previous is not None:
+        logger.info(f"Reused {len(texts) - embedded} of {len(texts)} passage and "
+                    f"{len(questions) - embedded_questions} of {len(questions)} question vectors "
+                    f"from {previous.version}")
+    prune_store(texts + questions, model, dimensions=reducer.request_dimensions)
+
+    arrays = {'question_vectors': question_vectors, **reducer.to_arrays()}
+    if index_backend != 'flat' and len(vectors):
+        index = create_index(vectors, index_backend, normalized=True, **backend_params)
+        arrays.update(index.to_arrays())
+        logger.info(f"Built {index_backend} index data: {index.memory_bytes / len(vectors):.0f} bytes per document")
+
+    artifact = RetrievalArtifact.create(
+        documents=documents,
+        vectors=vectors,
+        model=model,
+        source_sha256=file_sha256(source_path),
+        arrays=arrays,
+        index_backend=index_backend,
+        chunking=CHUNK_SETTINGS,
+        previous_version=previous.version if previous is not None else None,
+        **reducer.metadata(),
+        source_file=os.path.basename(source_path),
+    )
+    artifact.save(output_path)
+    logger.info(f"Wrote retrieval index {artifact.version} with {len(documents)} documents to {output_path}")
+    return artifact
+
+
+def upload_index(output_path, bucket_name=GCS_BUCKET_NAME):
+    """Upload the artifact next to the knowledge base in Cloud Storage."""
+    from google.cloud import storage
+
+    bucket = storage.Client().bucket(bucket_name)
+    blob = bucket.blob(f'data/{os.path.basename(output_path)}')
+    blob.upload_from_filename(output_path)
+    logger.info(f"Uploaded {output_path} to gs://{bucket_name}/{blob.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the retrieval index artifact.")
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='knowledge-base xlsx file')
+    parser.add_argument('--output', default=RAG_INDEX_PATH, help='artifact path to write')
+    parser.add_argument('--model', default=EMBEDDING_MODEL, help='embedding model name')
+    parser.add_argument('--index-backend', choices=INDEX_BACKENDS, default=RAG_INDEX_BACKEND,
+                        help='precompute index data for this vector index backend')
+    parser.add_argument('--dimensions', type=int, default=EMBEDDING_DIMENSIONS,
+                        help="embedding size in the index (default: EMBEDDING_DIMENSIONS or the model's full size)")
+    parser.add_argument('--reduction', choices=REDUCTION_METHODS, default=EMBEDDING_REDUCTION,
+                        help='how to reach --dimensions')
+    parser.add_argument('--full', action='store_true',
+                        help='re-embed everything instead of reusing vectors from the existing artifact')
+    parser.add_argument('--upload', action='store_true', help='also upload the artifact to GCS')
+    args = parser.parse_args()
+
+    build_index(args.source, args.output, model=args.model, index_backend=args.index_backend,
+                dimensions=args.dimensions, reduction=args.reduction, incremental=not args.full,
+                **index_params(args.index_backend))
+    if args.upload:
+        upload_index(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Split long answers into overlapping passages for retrieval."""
+import re
+
+# Sentence ends (after . ! ? ; :) and line breaks are preferred split points
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?;:])\s+|\n+')
+
+
+def _sentence_spans(text, max_chars):
+    """`(start, end)` spans of the sentences of `text`, none longer than `max_chars`."""
+    boundaries = [0] + [match.end() for match in SENTENCE_BOUNDARY.finditer(text)] + [len(text)]
+    spans = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        # Sentences that are too long on their own are cut at word boundaries
+        while end - start > max_chars:
+            cut = text.rfind(' ', start + 1, start + max_chars)
+            if cut <= start:
+                cut = start + max_chars
+            spans.append((start, cut))
+            start = cut
+        if text[start:end].strip():
+            spans.append((start, end))
+    return spans
+
+
+def split_passages(text, max_chars=800, overlap_chars=150):
+    """Split `text` into passages of at most `max_chars` characters.
+
+    Passages are built from whole sentences where possible, and each one
+    repeats up to `overlap_chars` characters of trailing sentences from the
+    previous passage so that facts spanning a boundary are not lost. Returns
+    `(start, passage)` pairs, where `passage == text[start:start + len(passage)]`.
+    """
+    if len(text) <= max_chars:
+        return [(0, text)] if text.strip() else []
+
+    spans = _sentence_spans(text, max_chars)
+    passages = []
+    first = 0
+    while first < len(spans):
+        start = spans[first][0]
+        last = first
+        while last + 1 < len(spans) and spans[last + 1][1] - start <= max_chars:
+            last += 1
+        end = spans[last][1]
+
+        passage = text[start:end]
+        stripped = passage.lstrip()
+        passages.append((start + len(passage) - len(stripped), stripped.rstrip()))
+        if last + 1 >= len(spans):
+            break
+
+        # Start the next passage with the trailing sentences that fit in the overlap
+        following = last + 1
+        while following - 1 > first and end - spans[following - 1][0] <= overlap_chars:
+            following -= 1
+        first = following
+    return passages
+
+
+def join_passages(passages):
+    """Reassemble text from `(start, passage)` pairs of one source text, dropping overlaps."""
+    text = ''
+    covered = 0
+    for start, passage in sorted(passages):
+        end = start + len(passage)
+        if end <= covered:
+            continue
+        if start >= covered:
+            text += (' ' if text else '') + passage
+        else:
+            text += passage[covered - start:]
+        covered = end
+    return text
+
+
+def chunk_documents(documents, max_chars=800, overlap_chars=150):
+    """Replace every document by passages of its answer.
+
+    Each passage keeps the question and source of its document and links
+    back to it through `parent` (the document's position) and `row` (the
+    spreadsheet row), with `start` giving the passage's offset in the answer.
+    `max_chars=0` disables chunking and only adds the links.
+    """
+    passages = []
+    for parent, doc in enumerate(documents):
+        answer = str(doc['answer'])
+        pieces = split_passages(answer, max_chars, overlap_chars) if max_chars else [(0, answer)]
+        for start, passage in pieces:
+            passages.append({
+                **doc,
+                'answer': passage,
+                'combined_text': f"Question: {doc['question']}\nAnswer: {passage}",
+                'parent': parent,
+                'start': start,
+            })
+    return passages
@@ -0,0 +1,111 @@
+"""Assemble retrieved passages into a prompt context that fits a token budget."""
+import re
+
+from .chunking import join_passages
+from .embeddings import estimate_tokens
+
+# Passages cut to fewer tokens than this are dropped instead of being included
+MIN_PASSAGE_TOKENS = 20
+
+# Positions right after a sentence end, used to cut passages cleanly
+SENTENCE_END = re.compile(r'[.!?;:](?=\s|$)')
+
+# Positions right after a word, used when no sentence end fits
+WORD_END = re.compile(r'\S(?=\s|$)')
+
+# Chat formats add a few tokens of framing to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class PackedContext:
+    __slots__ = ('text', 'sources', 'doc_ids', 'tokens', 'truncated')
+
+    def __init__(self, text, sources, doc_ids, tokens, truncated):
+        self.text = text
+        self.sources = sources
+        self.doc_ids = doc_ids
+        self.tokens = tokens
+        self.truncated = truncated
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Longest prefix of `text` that fits `max_tokens` and ends a sentence, or else a word; or ''."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    for boundary in (SENTENCE_END, WORD_END):
+        cut = ''
+        for match in boundary.finditer(text):
+            if estimate_tokens(text[:match.end()]) > max_tokens:
+                break
+            cut = text[:match.end()]
+        if cut:
+            return cut
+    return ''
+
+
+def estimate_message_tokens(messages):
+    """Offline estimate of the prompt tokens of chat-completion `messages`."""
+    return sum(estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def pack_context(documents, doc_ids, token_budget):
+    """Pack the retrieved documents, best first, into at most `token_budget` tokens.
+
+    Passages are grouped under one "Source:" header per source URL, exact
+    repeats are dropped and overlapping passages of the same answer are
+    merged. The returned sources also include the other URLs of deduplicated
+    passages. When the next merged passage does not fit, the best passage of
+    its answer is used alone, cut at the last sentence (or word) boundary that
+    fits if necessary, and packing stops.
+    """
+    groups = {}
+    seen = set()
+    for doc_id in doc_ids:
+        doc = documents[doc_id]
+        text = str(doc['answer']).strip()
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        parts = groups.setdefault(doc['source'], {})
+        parts.setdefault(doc.get('parent', doc_id), []).append((doc.get('start', 0), text, doc_id))
+
+    blocks = []
+    used_ids = []
+    used_tokens = 0
+    truncated = False
+    for source, parents in groups.items():
+        header = f"Source: {source}\n"
+        remaining = token_budget - used_tokens - estimate_tokens(header)
+        if remaining < MIN_PASSAGE_TOKENS:
+            truncated = True
+            break
+
+        texts = []
+        for passages in parents.values():
+            text = join_passages([(start, passage) for start, passage, _ in passages])
+            ids = [doc_id for _, _, doc_id in passages]
+            if estimate_tokens(text) > remaining:
+                # Passages are in retrieval order, so the first one is the best
+                _, best, best_id = passages[0]
+                text = truncate_to_tokens(best, remaining)
+                ids = [best_id]
+                truncated = True
+            if estimate_tokens(text) < MIN_PASSAGE_TOKENS:
+                break
+            texts.append(text)
+            used_ids.extend(ids)
+            remaining -= estimate_tokens(text)
+            if truncated:
+                break
+
+        if texts:
+            block = header + "\n".join(texts)
+            blocks.append(block)
+            used_tokens += estimate_tokens(block)
+        if truncated:
+            break
+
+    sources = list(dict.fromkeys(
+        source for doc_id in used_ids for source in documents[doc_id].get('sources', [documents[doc_id]['source']])
+    ))
+    return PackedContext("\n\n".join(blocks), sources, used_ids, used_tokens, truncated)
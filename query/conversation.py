@@ -0,0 +1,50 @@
+"""Turn a conversation into a compact retrieval query and bounded chat history."""
+
+# At most this many previous messages are sent to the LLM
+MAX_HISTORY_MESSAGES = 10
+# Longer previous messages (usually full answers) are truncated to this many characters
+MAX_HISTORY_MESSAGE_CHARS = 1500
+
+# Questions with at most this many words are treated as follow-ups and get context
+FOLLOW_UP_MAX_WORDS = 6
+# Characters of the previous user question added to a follow-up's retrieval query
+FOLLOW_UP_CONTEXT_CHARS = 200
+
+
+def truncate(text, max_chars):
+    """Cut `text` to at most `max_chars` characters, preferring a word boundary."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(' ', 1)[0]
+    return f"{cut}..."
+
+
+def build_retrieval_query(question, history=None):
+    """Text to embed for retrieval.
+
+    A standalone question is embedded as is, so repeated questions hit the
+    query cache. A short follow-up ("and for students?") is prefixed with the
+    beginning of the previous user question; assistant answers are never
+    embedded.
+    """
+    question = question.strip()
+    if not history or len(question.split()) > FOLLOW_UP_MAX_WORDS:
+        return question
+
+    for message in reversed(history):
+        if message.get('role') == 'user' and message.get('content', '').strip() != question:
+            previous = truncate(message['content'].strip(), FOLLOW_UP_CONTEXT_CHARS)
+            return f"{previous}\n{question}"
+    return question
+
+
+def build_chat_history(history=None, max_messages=MAX_HISTORY_MESSAGES,
+                       max_chars=MAX_HISTORY_MESSAGE_CHARS):
+    """The most recent conversation turns as chat-completion messages."""
+    if not history:
+        return []
+    return [
+        {'role': message['role'], 'content': truncate(message['content'], max_chars)}
+        for message in history[-max_messages:]
+        if message.get('role') in ('user', 'assistant') and message.get('content')
+    ]
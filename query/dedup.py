@@ -0,0 +1,109 @@
+"""Collapse near-duplicate documents with MinHash signatures and LSH buckets."""
+import zlib
+
+import numpy as np
+
+from .bm25 import TOKEN_PATTERN, fold_diacritics
+
+# Words per shingle; 3-word shingles tolerate small edits but not reordered paragraphs
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 128
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Hashes of the distinct `size`-word shingles of `text` (its words, if shorter)."""
+    words = TOKEN_PATTERN.findall(fold_diacritics(text))
+    grams = {' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 0))} or set(words)
+    return np.array(sorted(zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype=np.uint64)
+
+
+def minhash_signatures(texts, num_permutations=NUM_PERMUTATIONS, seed=0):
+    """MinHash signature of every text, as a (texts, num_permutations) uint32 matrix.
+
+    Each permutation is a multiply-shift hash `(a * x + b) >> 32` over 64-bit
+    integers, so a whole signature is one vectorized min. The fraction of equal
+    positions in two signatures estimates the Jaccard similarity of their
+    shingle sets. Texts without words get all-max signatures and match nothing.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 63, num_permutations, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, num_permutations, dtype=np.uint64)
+
+    signatures = np.full((len(texts), num_permutations), np.iinfo(np.uint32).max, dtype=np.uint32)
+    with np.errstate(over='ignore'):
+        for row, text in enumerate(texts):
+            hashes = shingles(str(text))
+            if len(hashes):
+                signatures[row] = ((a[:, None] * hashes[None, :] + b[:, None]) >> np.uint64(32)).min(axis=1)
+    return signatures
+
+
+def lsh_bands(num_permutations, threshold):
+    """`(bands, rows)` splitting the signature so that pairs near `threshold` collide.
+
+    Two signatures share a bucket in some band with probability 1 - (1 - s^rows)^bands
+    for Jaccard similarity s; the S-curve's midpoint (1 / bands)^(1 / rows) is put
+    a little below `threshold`, trading extra candidate checks for recall.
+    """
+    target = threshold * 0.9
+    splits = [(num_permutations // rows, rows) for rows in range(1, num_permutations + 1)
+              if num_permutations % rows == 0]
+    return min(splits, key=lambda split: abs((1 / split[0]) ** (1 / split[1]) - target))
+
+
+def near_duplicate_groups(signatures, threshold=0.8):
+    """Groups of row indices whose estimated Jaccard similarity reaches `threshold`.
+
+    Rows sharing an LSH bucket are candidates; candidates whose signatures
+    agree on at least `threshold` of their positions are joined, transitively.
+    Every group is sorted and the groups are ordered by their first row.
+    """
+    parents = list(range(len(signatures)))
+
+    def find(row):
+        while parents[row] != row:
+            parents[row] = parents[parents[row]]
+            row = parents[row]
+        return row
+
+    empty = (signatures == np.iinfo(np.uint32).max).all(axis=1)
+    bands, rows = lsh_bands(signatures.shape[1], threshold)
+    for band in range(bands):
+        buckets = {}
+        for row, key in enumerate(signatures[:, band * rows:(band + 1) * rows]):
+            if not empty[row]:
+                buckets.setdefault(key.tobytes(), []).append(row)
+        for members in buckets.values():
+            for position, row in enumerate(members):
+                for other in members[:position]:
+                    root, other_root = find(row), find(other)
+                    if root != other_root and np.mean(signatures[row] == signatures[other]) >= threshold:
+                        parents[max(root, other_root)] = min(root, other_root)
+
+    groups = {}
+    for row in range(len(signatures)):
+        groups.setdefault(find(row), []).append(row)
+    return list(groups.values())
+
+
+def dedup_documents(documents, threshold=0.8, seed=0):
+    """Collapse documents whose answers are near-duplicates into their first occurrence.
+
+    The kept document gains `sources` and `questions`: every distinct source
+    URL and question of the documents it replaces, its own first. A
+    `threshold` of 0 disables deduplication and only adds these lists.
+    """
+    groups = [[row] for row in range(len(documents))]
+    if threshold and len(documents) > 1:
+        groups = near_duplicate_groups(minhash_signatures([doc['answer'] for doc in documents], seed=seed),
+                                       threshold)
+
+    kept = []
+    for group in groups:
+        members = [documents[row] for row in group]
+        kept.append({
+            **members[0],
+            'sources': list(dict.fromkeys(doc['source'] for doc in members)),
+            'questions': list(dict.fromkeys(str(doc['question']) for doc in members)),
+        })
+    return kept
@@ -0,0 +1,172 @@
+"""Compact representations of prepared documents: slotted records in memory, columns on disk.
+
+In memory, LegalRAG keeps every passage as a Document: a `__slots__` record
+whose repeated strings (the question shared by up to three answers, source
+URLs) are stored once, and whose `combined_text` is built when needed.
+
+Parsing the knowledge-base spreadsheet and chunking and deduplicating its
+answers is the slowest part of an in-memory start. The result depends only
+on the spreadsheet and the chunking settings, so it is cached in the
+container format of query/artifact.py, one column per field: every string
+field is a UTF-8 blob plus int64 byte offsets, integer fields are int64
+arrays, and list fields add int64 offsets into a string column. Loading
+memory-maps the file and slices the blobs; nothing is parsed but the small
+JSON header.
+"""
+import logging
+
+import numpy as np
+
+from .artifact import read_container, write_container
+
+logger = logging.getLogger('legal_rag')
+
+DOCUMENT_CACHE_MAGIC = b'LRAGDOC1'
+DOCUMENT_CACHE_FORMAT_VERSION = 2
+
+STRING_FIELDS = ('question', 'answer', 'source')
+INTEGER_FIELDS = ('row', 'parent', 'start')
+LIST_FIELDS = ('sources', 'questions')
+DOCUMENT_KEYS = STRING_FIELDS + INTEGER_FIELDS + LIST_FIELDS + ('combined_text',)
+
+
+class Document:
+    """One prepared passage, read like the dict it replaces: `doc['answer']`, `doc.get('parent')`.
+
+    `sources` and `questions` are tuples. `combined_text`, the text that is
+    embedded and indexed, is derived from the question and answer.
+    """
+    __slots__ = STRING_FIELDS + INTEGER_FIELDS + LIST_FIELDS
+
+    def __init__(self, question, answer, source, row, parent, start, sources, questions):
+        self.question = question
+        self.answer = answer
+        self.source = source
+        self.row = row
+        self.parent = parent
+        self.start = start
+        self.sources = sources
+        self.questions = questions
+
+    @property
+    def combined_text(self):
+        return f"Question: {self.question}\nAnswer: {self.answer}"
+
+    def keys(self):
+        return DOCUMENT_KEYS
+
+    def __getitem__(self, key):
+        if key not in DOCUMENT_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in DOCUMENT_KEYS else default
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    def __repr__(self):
+        return f"Document(row={self.row}, start={self.start}, source={self.source!r})"
+
+
+def compact_documents(documents):
+    """Documents for the document dicts produced by knowledge_base.prepare_documents.
+
+    Equal strings, and equal `sources`/`questions` tuples, become one shared object.
+    """
+    shared = {}
+    share = shared.setdefault
+    compact = []
+    for position, doc in enumerate(documents):
+        question = share(str(doc['question']), str(doc['question']))
+        source = share(str(doc['source']), str(doc['source']))
+        sources = tuple(share(str(value), str(value)) for value in doc.get('sources', [source]))
+        questions = tuple(share(str(value), str(value)) for value in doc.get('questions', [question]))
+        compact.append(Document(
+            question, str(doc['answer']), source,
+            int(doc.get('row', position)), int(doc.get('parent', position)), int(doc.get('start', 0)),
+            share(sources, sources), share(questions, questions),
+        ))
+    return compact
+
+
+def encode_strings(values):
+    """`(data, offsets)`: the UTF-8 bytes of `values` concatenated, and where each one starts and ends."""
+    encoded = [str(value).encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(data, offsets):
+    """The strings encoded by encode_strings."""
+    blob = data.tobytes()
+    bounds = offsets.tolist()
+    return [blob[start:end].decode('utf-8') for start, end in zip(bounds, bounds[1:])]
+
+
+def encode_documents(documents, prefix=''):
+    """Named column arrays holding `documents` (Documents or document dicts).
+
+    Every array name starts with `prefix`, so the columns can be stored next
+    to other arrays, as in the retrieval artifact.
+    """
+    arrays = {}
+    for field in STRING_FIELDS:
+        arrays[f'{prefix}{field}_data'], arrays[f'{prefix}{field}_offsets'] = encode_strings(
+            doc[field] for doc in documents)
+    for field in INTEGER_FIELDS:
+        arrays[f'{prefix}{field}'] = np.array([int(doc[field]) for doc in documents], dtype=np.int64)
+    for field in LIST_FIELDS:
+        arrays[f'{prefix}{field}_data'], arrays[f'{prefix}{field}_offsets'] = encode_strings(
+            value for doc in documents for value in doc[field])
+        lists = np.zeros(len(documents) + 1, dtype=np.int64)
+        np.cumsum([len(doc[field]) for doc in documents], out=lists[1:])
+        arrays[f'{prefix}{field}_lists'] = lists
+    return arrays
+
+
+def decode_documents(arrays, prefix=''):
+    """The documents stored in `arrays` by encode_documents, as compact Documents."""
+    columns = {field: decode_strings(arrays[f'{prefix}{field}_data'], arrays[f'{prefix}{field}_offsets'])
+               for field in STRING_FIELDS}
+    for field in INTEGER_FIELDS:
+        columns[field] = arrays[f'{prefix}{field}'].tolist()
+    for field in LIST_FIELDS:
+        values = decode_strings(arrays[f'{prefix}{field}_data'], arrays[f'{prefix}{field}_offsets'])
+        bounds = arrays[f'{prefix}{field}_lists'].tolist()
+        columns[field] = [values[start:end] for start, end in zip(bounds, bounds[1:])]
+
+    fields = STRING_FIELDS + INTEGER_FIELDS + LIST_FIELDS
+    return compact_documents(dict(zip(fields, values)) for values in zip(*(columns[field] for field in fields)))
+
+
+def save_document_cache(path, documents, source_sha256, settings):
+    """Atomically write `documents`, prepared from the source with `source_sha256` using `settings`."""
+    metadata = {
+        'format_version': DOCUMENT_CACHE_FORMAT_VERSION,
+        'source_sha256': source_sha256,
+        'settings': settings,
+        'count': len(documents),
+    }
+    write_container(path, metadata, encode_documents(documents), magic=DOCUMENT_CACHE_MAGIC)
+
+
+def load_document_cache(path, source_sha256, settings):
+    """Documents cached at `path` for this source and settings; None if there are none."""
+    try:
+        metadata, arrays = read_container(path, magic=DOCUMENT_CACHE_MAGIC)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable document cache {path}: {e}")
+        return None
+
+    if metadata.get('format_version') != DOCUMENT_CACHE_FORMAT_VERSION:
+        logger.info(f"Ignoring document cache with format version {metadata.get('format_version')}")
+        return None
+    if metadata.get('source_sha256') != source_sha256 or metadata.get('settings') != settings:
+        logger.info("Document cache is stale (knowledge base or chunking settings changed)")
+        return None
+    return decode_documents(arrays)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from .embeddings import EMBEDDING_MODEL
+
+logger = logging.getLogger('legal_rag')
+
+MATRIX_FILE = 'embeddings.npy'
+MANIFEST_FILE = 'embeddings.manifest.json'
+STORE_FORMAT_VERSION = 1
+
+
+def content_key(text, model=EMBEDDING_MODEL):
+    """Compact key for an embedding: a hash of the model name and the input text."""
+    return hashlib.blake2b(f"{model}\n{text}".encode('utf-8'), digest_size=16).hexdigest()
+
+
+def atomic_write(path, write):
+    """Write a file through a temporary sibling so readers never see a partial file.
+
+    `write` is called with the open binary file. The temporary file is named
+    after the writing process and thread, so concurrent writers of the same
+    path never interleave their bytes; the last one to finish wins.
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+class EmbeddingStore:
+    """Embedding cache backed by a raw float32 matrix and a key/row manifest.
+
+    On disk the store is two files in one directory: `embeddings.npy`, a plain
+    NumPy array that is memory-mapped read-only on load, and
+    `embeddings.manifest.json`, which records the model name and maps each
+    content key to its row. New embeddings are kept in memory until `save()`.
+
+    The store behaves like a dict keyed by input text, so it can be used in
+    place of the old in-memory embeddings dict.
+    """
+
+    def __init__(self, model=EMBEDDING_MODEL, vectors=None, rows=None):
+        self.model = model
+        self.vectors = vectors
+        self.rows = rows or {}
+        self.pending = {}
+
+    @classmethod
+    def load(cls, directory, model=EMBEDDING_MODEL):
+        """Memory-map a saved store; returns an empty store if none is usable."""
+        matrix_path = os.path.join(directory, MATRIX_FILE)
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if not (os.path.exists(matrix_path) and os.path.exists(manifest_path)):
+            return cls(model)
+
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('model') != model:
+                logger.warning(f"Ignoring embedding store built with model {manifest.get('model')}")
+                return cls(model)
+
+            vectors = np.load(matrix_path, mmap_mode='r')
+            if vectors.dtype != np.float32 or len(vectors) != len(manifest['rows']):
+                raise ValueError("Embedding matrix does not match its manifest")
+            return cls(model, vectors, manifest['rows'])
+        except Exception as e:
+            logger.error(f"Failed to load embedding store from {directory}: {e}")
+            return cls(model)
+
+    def save(self, directory):
+        """Write all embeddings, including pending ones, and re-map the result."""
+        os.makedirs(directory, exist_ok=True)
+
+        rows = dict(self.rows)
+        blocks = [] if self.vectors is None else [np.asarray(self.vectors)]
+        if self.pending:
+            first_row = len(rows)
+            for offset, key in enumerate(self.pending):
+                rows[key] = first_row + offset
+            blocks.append(np.stack(list(self.pending.values())))
+        if not blocks:
+            return
+
+        matrix = np.ascontiguousarray(np.concatenate(blocks), dtype=np.float32)
+        manifest = {
+            'format_version': STORE_FORMAT_VERSION,
+            'model': self.model,
+            'dimensions': int(matrix.shape[1]),
+            'rows': rows,
+        }
+
+        matrix_path = os.path.join(directory, MATRIX_FILE)
+        atomic_write(matrix_path, lambda f: np.save(f, matrix))
+        atomic_write(os.path.join(directory, MANIFEST_FILE),
+                      lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+
+        self.vectors = np.load(matrix_path, mmap_mode='r')
+        self.rows = rows
+        self.pending = {}
+
+    def key(self, text):
+        return content_key(text, self.model)
+
+    def get(self, text, default=None):
+        key = self.key(text)
+        if key in self.pending:
+            return self.pending[key]
+        row = self.rows.get(key)
+        if row is None:
+            return default
+        return self.vectors[row]
+
+    def __getitem__(self, text):
+        vector = self.get(text)
+        if vector is None:
+            raise KeyError(text)
+        return vector
+
+    def __setitem__(self, text, vector):
+        self.pending[self.key(text)] = np.asarray(vector, dtype=np.float32)
+
+    def __contains__(self, text):
+        key = self.key(text)
+        return key in self.pending or key in self.rows
+
+    def __len__(self):
+        return len(self.rows) + len(self.pending)
+
+    def update(self, items):
+        for text, vector in items:
+            self[text] = vector
+
+    def retain(self, texts):
+        """Drop the embeddings of all texts not in `texts`; returns how many were dropped.
+
+        Kept embeddings are copied into memory, so the next `save()` writes a
+        compact matrix.
+        """
+        keep = {self.key(text) for text in texts}
+        kept_rows = [(key, row) for key, row in self.rows.items() if key in keep]
+        dropped = len(self) - len(kept_rows)
+        self.pending = {key: vector for key, vector in self.pending.items() if key in keep}
+        dropped -= len(self.pending)
+
+        if dropped:
+            self.vectors = np.array(self.vectors[[row for _, row in kept_rows]]) if kept_rows else None
+            self.rows = {key: position for position, (key, _) in enumerate(kept_rows)}
+        return dropped
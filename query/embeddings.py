@@ -0,0 +1,108 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('legal_rag')
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Full output size of the supported embedding models
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+# Request-size limits of the OpenAI embeddings endpoint
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300000
+MAX_INPUT_TOKENS = 8191
+
+# Polish text tokenizes to roughly 3 characters per token; err on the safe side
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text):
+    """Cheap upper-bound estimate of the number of tokens in `text`."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def clip_input(text, max_tokens=MAX_INPUT_TOKENS):
+    """Clip `text` so a single input never exceeds the per-input token limit."""
+    max_chars = (max_tokens - 1) * CHARS_PER_TOKEN
+    if len(text) > max_chars:
+        logger.warning(f"Clipping embedding input from {len(text)} to {max_chars} characters")
+        return text[:max_chars]
+    return text
+
+
+def embedding_model_id(model=EMBEDDING_MODEL, dimensions=None):
+    """Identifier of the vectors a model returns: the model name plus any requested size.
+
+    Used wherever embeddings are cached, so vectors of different sizes never mix.
+    """
+    return f"{model}:{dimensions}" if dimensions else model
+
+
+def model_dimensions(model=EMBEDDING_MODEL, dimensions=None):
+    """Size of the vectors returned for `model` with the `dimensions` request parameter."""
+    return dimensions or MODEL_DIMENSIONS.get(model, 1536)
+
+
+def iter_batches(texts, max_inputs=MAX_BATCH_INPUTS, max_tokens=MAX_BATCH_TOKENS):
+    """Split `texts` into consecutive batches of positions that fit one request."""
+    batch = []
+    batch_tokens = 0
+    for position, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_inputs or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(position)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def embed_texts(client, texts, model=EMBEDDING_MODEL, dimensions=None,
+                max_inputs=MAX_BATCH_INPUTS, max_tokens=MAX_BATCH_TOKENS):
+    """Embed `texts` with as few embeddings requests as the limits allow.
+
+    Returns one embedding per input text, in input order. `dimensions` asks
+    the API for shortened vectors (text-embedding-3 models only).
+    """
+    texts = [clip_input(text) for text in texts]
+    vectors = [None] * len(texts)
+    options = {'dimensions': dimensions} if dimensions else {}
+
+    for batch in iter_batches(texts, max_inputs, max_tokens):
+        response = client.embeddings.create(
+            model=model,
+            input=[texts[position] for position in batch],
+            **options
+        )
+        # The API reports each item's position within the request
+        for item in response.data:
+            vectors[batch[item.index]] = item.embedding
+
+    return vectors
+
+
+async def aembed_texts(client, texts, model=EMBEDDING_MODEL, dimensions=None,
+                       max_inputs=MAX_BATCH_INPUTS, max_tokens=MAX_BATCH_TOKENS):
+    """Async variant of embed_texts for an AsyncOpenAI client; batches run concurrently."""
+    texts = [clip_input(text) for text in texts]
+    vectors = [None] * len(texts)
+    options = {'dimensions': dimensions} if dimensions else {}
+
+    async def embed_batch(batch):
+        response = await client.embeddings.create(
+            model=model,
+            input=[texts[position] for position in batch],
+            **options
+        )
+        for item in response.data:
+            vectors[batch[item.index]] = item.embedding
+
+    await asyncio.gather(*(embed_batch(batch) for batch in iter_batches(texts, max_inputs, max_tokens)))
+    return vectors
@@ -0,0 +1,133 @@
+"""Local fake OpenAI server for benchmarks and manual testing.
+
+Implements just enough of POST /v1/embeddings and POST /v1/chat/completions
+(including `stream: true`) to be used with the official client. Point
+OPENAI_BASE_URL at it to run LegalRAG or the API server without a real key:
+
+    python -m query.fake_openai --port 8001
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .embeddings import EMBEDDING_MODEL
+
+FAKE_ANSWER = "This is a canned answer from the fake OpenAI server."
+
+
+def fake_embedding(text, dimensions=1536):
+    """Deterministic pseudo-embedding derived from the text's hash."""
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [(digest[i % len(digest)] - 128) / 128.0 for i in range(dimensions)]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length))
+
+        self.server.request_count += 1
+        time.sleep(self.server.latency)
+
+        if self.path.endswith('/embeddings'):
+            self.send_json(self.embeddings(payload))
+        elif self.path.endswith('/chat/completions'):
+            if payload.get('stream'):
+                self.stream_chat(payload)
+            else:
+                self.send_json(self.chat(payload))
+        else:
+            self.send_error(404)
+
+    def embeddings(self, payload):
+        inputs = payload['input']
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self.server.input_count += len(inputs)
+
+        return {
+            'object': 'list',
+            'model': payload.get('model', EMBEDDING_MODEL),
+            'data': [
+                {'object': 'embedding', 'index': i,
+                 'embedding': fake_embedding(text, payload.get('dimensions', 1536))}
+                for i, text in enumerate(inputs)
+            ],
+            'usage': {'prompt_tokens': 0, 'total_tokens': 0},
+        }
+
+    def chat(self, payload):
+        return {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': FAKE_ANSWER},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        }
+
+    def stream_chat(self, payload):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+
+        for word in FAKE_ANSWER.split(' '):
+            chunk = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': payload.get('model'),
+                'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.server.token_latency)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_server(latency=0.0, token_latency=0.0, port=0):
+    """Start the fake server in a background thread; returns the server object."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeOpenAIHandler)
+    server.latency = latency
+    server.token_latency = token_latency
+    server.request_count = 0
+    server.input_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake OpenAI server.")
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated seconds per request')
+    parser.add_argument('--token-latency', type=float, default=0.05, help='simulated seconds per streamed token')
+    args = parser.parse_args()
+
+    server = start_fake_server(args.latency, args.token_latency, args.port)
+    print(f"Fake OpenAI server listening on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Combine ranked result lists from several retrievers into one ranking."""
+import numpy as np
+
+FUSION_METHODS = ('rrf', 'weighted')
+
+# Rank offset of reciprocal rank fusion; 60 is the value from the original paper
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings, weights=None, k=RRF_K):
+    """Fuse ranked id lists by summing `weight / (k + rank)` for every id."""
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + weight / (k + rank + 1)
+    return fused
+
+
+def weighted_score_fusion(results, weights=None):
+    """Fuse `(ids, scores)` results by a weighted sum of min-max normalized scores."""
+    weights = weights or [1.0] * len(results)
+    fused = {}
+    for (ids, scores), weight in zip(results, weights):
+        if len(ids) == 0:
+            continue
+        scores = np.asarray(scores, dtype=np.float32)
+        spread = scores.max() - scores.min()
+        normalized = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+        for doc_id, score in zip(ids, normalized):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + weight * float(score)
+    return fused
+
+
+def fuse(results, method='rrf', weights=None, top_k=3):
+    """Ids of the `top_k` best documents across `(ids, scores)` results, best first."""
+    if method == 'rrf':
+        fused = reciprocal_rank_fusion([ids for ids, _ in results], weights)
+    elif method == 'weighted':
+        fused = weighted_score_fusion(results, weights)
+    else:
+        raise ValueError(f"Unknown fusion method {method!r}; expected one of {FUSION_METHODS}")
+    return sorted(fused, key=fused.get, reverse=True)[:top_k]
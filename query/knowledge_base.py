@@ -0,0 +1,58 @@
+"""Read the knowledge-base spreadsheet into retrieval documents.
+
+This is the only module of the serving package that needs pandas (and
+openpyxl, for xlsx files); LegalRAG imports it lazily, only when no usable
+prebuilt index exists. See requirements-build.txt.
+"""
+import logging
+
+import pandas as pd
+
+from .chunking import chunk_documents
+from .dedup import dedup_documents
+
+logger = logging.getLogger('legal_rag')
+
+
+def read_knowledge_base(path):
+    """The knowledge-base spreadsheet at `path` as a DataFrame."""
+    return pd.read_excel(path)
+
+
+def prepare_documents(df, max_chars=800, overlap_chars=150, dedup_threshold=0.8):
+    """Prepare documents from the knowledge-base DataFrame, one per answer passage.
+
+    Answers longer than `max_chars` are split into overlapping passages (see
+    chunk_documents); every passage records its spreadsheet `row` and source.
+    Near-duplicate passages, e.g. one page scraped for several questions, are
+    then collapsed (see dedup_documents) into one listing all `sources`.
+    """
+    if df is None or df.empty:
+        return []
+
+    documents = []
+
+    for position, (idx, row) in enumerate(df.iterrows()):
+        # Get the question
+        question = row['Question']
+
+        # Combine answers from all sources
+        for i in range(1, 4):
+            try:
+                if pd.notna(row.get(f'Answer{i}')):
+                    doc = {
+                        'question': question,
+                        'answer': row[f'Answer{i}'],
+                        'source': row.get(f'Site{i}', 'Unknown'),
+                        'combined_text': f"Question: {question}\nAnswer: {row[f'Answer{i}']}",
+                        'row': position
+                    }
+                    documents.append(doc)
+            except (KeyError, TypeError) as e:
+                logger.warning(f"Error processing row {idx}, answer {i}: {e}")
+
+    passages = chunk_documents(documents, max_chars, overlap_chars)
+    unique = dedup_documents(passages, dedup_threshold)
+    logger.info(f"Prepared {len(unique)} passages from {len(documents)} answers "
+                f"({len(passages) - len(unique)} near-duplicates collapsed)")
+    return unique
@@ -1,13 +1,42 @@
-import pandas as pd
+import importlib.util
 import numpy as np
-from openai import OpenAI
-from sklearn.metrics.pairwise import cosine_similarity
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI
+import asyncio
 import os
+import threading
+import time
 import tempfile
 import json
 from dotenv import load_dotenv
 import logging
 
+from .answer_cache import SemanticAnswerCache
+from .artifact import RetrievalArtifact, file_sha256
+from .bm25 import BM25Index
+from .chunking import join_passages
+from .context import estimate_message_tokens, pack_context
+from .conversation import build_chat_history, build_retrieval_query
+from .document_store import compact_documents, load_document_cache, save_document_cache
+from .embedding_store import MANIFEST_FILE, MATRIX_FILE, EmbeddingStore, atomic_write
+from .embeddings import (
+    EMBEDDING_MODEL,
+    aembed_texts,
+    embed_texts,
+    embedding_model_id,
+)
+from .fusion import fuse
+from .query_cache import QueryEmbeddingCache
+from .reduction import DimensionReducer
+from .relevance import select_relevant
+from .vector_index import (
+    INDEX_CLASSES,
+    QUANTIZED_BACKENDS,
+    BruteForceIndex,
+    create_index,
+    normalize_rows,
+)
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('legal_rag')
@@ -24,6 +53,105 @@ if not OPENAI_API_KEY:
 USE_GCS = os.getenv('USE_GCS', 'true').lower() == 'true'
 GCS_BUCKET_NAME = os.getenv('GCS_BUCKET_NAME', 'pl-foreigners-legal-advisor')
 
+# Embedding size for retrieval (0 = the model's full size) and how it is reached:
+# 'api' (ask the API for shorter vectors), 'truncate' or 'pca' (reduce full vectors locally)
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', '0')) or None
+EMBEDDING_REDUCTION = os.getenv('EMBEDDING_REDUCTION', 'api').lower()
+
+# Local directory holding the memory-mapped embedding store
+EMBEDDINGS_DIR = os.getenv(
+    'EMBEDDINGS_DIR',
+    os.path.join(tempfile.gettempdir(), 'legal_rag_embeddings')
+)
+
+# Query embedding cache: in-memory LRU plus optional SQLite tier
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', '86400'))
+QUERY_CACHE_DB = os.getenv('QUERY_CACHE_DB')
+
+# Semantic answer cache: minimum cosine similarity for a hit, maximum entries (0 disables)
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '512'))
+
+# Answers longer than CHUNK_MAX_CHARS are split into passages overlapping by up to
+# CHUNK_OVERLAP_CHARS; retrieval and prompts then use passages (0 disables chunking)
+CHUNK_MAX_CHARS = int(os.getenv('CHUNK_MAX_CHARS', '800'))
+CHUNK_OVERLAP_CHARS = int(os.getenv('CHUNK_OVERLAP_CHARS', '150'))
+
+# Passages whose estimated word-shingle Jaccard similarity reaches DEDUP_THRESHOLD are
+# collapsed into one that keeps every source URL (0 disables deduplication)
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.8'))
+CHUNK_SETTINGS = {'max_chars': CHUNK_MAX_CHARS, 'overlap_chars': CHUNK_OVERLAP_CHARS,
+                  'dedup_threshold': DEDUP_THRESHOLD}
+
+# Columnar cache of the documents prepared from the knowledge base, used when there
+# is no prebuilt index so the xlsx is parsed only when it changes (empty disables)
+DOCUMENT_CACHE_PATH = os.getenv('DOCUMENT_CACHE_PATH', os.path.join(EMBEDDINGS_DIR, 'documents.cache'))
+
+# Maximum estimated tokens of retrieved passages packed into each prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1000'))
+
+# FAQ fast path: answer near-exact matches of a stored question with its stored answers
+FAQ_FAST_PATH = os.getenv('FAQ_FAST_PATH', 'false').lower() == 'true'
+FAQ_THRESHOLD = float(os.getenv('FAQ_THRESHOLD', '0.92'))
+
+# Retrieval: 'vector', 'hybrid' (vector and BM25 rankings fused with RAG_FUSION,
+# 'rrf' or 'weighted') or 'lexical' (BM25 only, no embedding calls). RAG_HYBRID_ALPHA
+# weights the vector ranking against BM25 in hybrid mode.
+RAG_RETRIEVAL_MODE = os.getenv('RAG_RETRIEVAL_MODE', 'vector').lower()
+RAG_FUSION = os.getenv('RAG_FUSION', 'rrf').lower()
+RAG_HYBRID_ALPHA = float(os.getenv('RAG_HYBRID_ALPHA', '0.5'))
+
+# Relevance: at most RAG_TOP_K documents are used per question. They need a cosine
+# similarity of at least RAG_MIN_SCORE (0 disables the floor) and within RAG_SCORE_MARGIN
+# of the best match; BM25-only retrieval keeps scores of at least RAG_LEXICAL_RATIO times
+# the best. Questions with no document above the floor are answered without the LLM.
+RAG_TOP_K = int(os.getenv('RAG_TOP_K', '5'))
+RAG_MIN_SCORE = float(os.getenv('RAG_MIN_SCORE', '0.25'))
+RAG_SCORE_MARGIN = float(os.getenv('RAG_SCORE_MARGIN', '0.1'))
+RAG_LEXICAL_RATIO = float(os.getenv('RAG_LEXICAL_RATIO', '0.3'))
+
+# Seconds to wait for a query embedding, which is never retried; on failure hybrid
+# mode falls back to BM25
+QUERY_EMBEDDING_TIMEOUT = float(os.getenv('QUERY_EMBEDDING_TIMEOUT', '10'))
+
+# Seconds to wait for each embeddings request of an index build, which is never
+# retried; after a failed build, retrieval uses BM25 (hybrid mode) or fails fast
+# for INDEX_RETRY_SECONDS before the next build is attempted
+INDEX_BUILD_TIMEOUT = float(os.getenv('INDEX_BUILD_TIMEOUT', '60'))
+INDEX_RETRY_SECONDS = float(os.getenv('INDEX_RETRY_SECONDS', '60'))
+
+# Maximum concurrent connections in the pooled async OpenAI client
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '100'))
+
+CHAT_MODEL = "gpt-3.5-turbo"
+SYSTEM_PROMPT = "You are a helpful legal assistant specializing in Polish law. Provide accurate, clear answers based on the given context."
+NO_INFORMATION_ANSWER = "I'm sorry, but I don't have enough information in my database to answer your question accurately. Please try a different question or contact a legal advisor for assistance."
+ERROR_ANSWER = "I'm sorry, I encountered an error while processing your request. Please try again later."
+
+# Prebuilt retrieval index written by `python -m query.build_index`
+RAG_INDEX_PATH = os.getenv(
+    'RAG_INDEX_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'retrieval_index.bin')
+)
+
+# Reading the xlsx knowledge base needs the build dependencies (requirements-build.txt);
+# serving a prebuilt index does not
+XLSX_SUPPORT = all(importlib.util.find_spec(name) is not None for name in ('pandas', 'openpyxl'))
+
+# Knowledge base and prebuilt index objects in the GCS bucket
+KNOWLEDGE_BASE_BLOB = 'data/legal_questions_answers.xlsx'
+INDEX_BLOB = f'data/{os.path.basename(RAG_INDEX_PATH)}'
+
+# Document vector index: 'flat' (exact), 'ivf' (approximate, for large corpora),
+# or 'int8' / 'pq' (compressed codes, reranked against memory-mapped full vectors).
+# RAG_IVF_NLIST=0 and RAG_PQ_SUBSPACES=0 pick a value from the corpus size/dimensions.
+RAG_INDEX_BACKEND = os.getenv('RAG_INDEX_BACKEND', 'flat').lower()
+RAG_IVF_NLIST = int(os.getenv('RAG_IVF_NLIST', '0'))
+RAG_IVF_NPROBE = int(os.getenv('RAG_IVF_NPROBE', '8'))
+RAG_PQ_SUBSPACES = int(os.getenv('RAG_PQ_SUBSPACES', '0'))
+RAG_RERANK_CANDIDATES = int(os.getenv('RAG_RERANK_CANDIDATES', '50'))
+
 # Import Google Cloud Storage only if we're using it
 if USE_GCS:
     try:
@@ -36,13 +164,81 @@ if USE_GCS:
         logger.warning(f"Error initializing Google Cloud Storage: {e}. Using local storage only.")
         USE_GCS = False
 
+def create_openai_clients():
+    """Sync and async OpenAI clients; the async one pools connections for the API server."""
+    if not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
+    
+    client = OpenAI(api_key=OPENAI_API_KEY)
+    # Shared connection pool for concurrent requests from the API server
+    async_client = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+            )
+        )
+    )
+    return client, async_client
+
+def with_request_options(client, timeout=None, max_retries=None):
+    """`client`, or a copy of it with a different request timeout and/or retry count."""
+    options = {name: value for name, value in (('timeout', timeout), ('max_retries', max_retries))
+               if value is not None}
+    return client.with_options(**options) if options else client
+
+def download_blob(blob, path):
+    """Download a GCS blob through a temporary sibling, so files still mapped by a
+    previous index are replaced rather than overwritten in place."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    atomic_write(path, blob.download_to_file)
+
+def index_params(backend):
+    """Constructor parameters for a `backend` vector index from the RAG_* settings."""
+    if backend == 'ivf':
+        return {'nlist': RAG_IVF_NLIST or None, 'nprobe': RAG_IVF_NPROBE}
+    if backend == 'int8':
+        return {'rerank': RAG_RERANK_CANDIDATES}
+    if backend == 'pq':
+        return {'subspaces': RAG_PQ_SUBSPACES or None, 'rerank': RAG_RERANK_CANDIDATES}
+    return {}
+
+def group_questions(documents):
+    """Unique questions in first-seen order and, for each, the ids of its documents."""
+    positions = {}
+    questions = []
+    doc_ids = []
+    
+    for doc_id, doc in enumerate(documents):
+        # Deduplicated documents answer every question they were collapsed from
+        for question in doc.get('questions', [str(doc['question'])]):
+            if question not in positions:
+                positions[question] = len(questions)
+                questions.append(question)
+                doc_ids.append([])
+            doc_ids[positions[question]].append(doc_id)
+    
+    return questions, doc_ids
+
 class LegalRAG:
-    def __init__(self):
+    def __init__(self, client=None, async_client=None, refresh_index=False):
+        """Load the knowledge base and its retrieval index.
+        
+        `client` and `async_client` reuse existing OpenAI clients (see reload);
+        with `refresh_index`, the prebuilt index is downloaded from GCS even if
+        a local copy exists.
+        """
         # Initialize OpenAI client
-        if OPENAI_API_KEY:
-            self.client = OpenAI(api_key=OPENAI_API_KEY)
+        if client is not None and async_client is not None:
+            self.client = client
+            self.async_client = async_client
         else:
-            raise ValueError("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
+            self.client, self.async_client = create_openai_clients()
+        
+        # Seconds spent in each loading stage, reported by the API's readiness check
+        self.load_timings = {}
+        self._stage_start = time.perf_counter()
         
         # Set the bucket name
         self.bucket_name = GCS_BUCKET_NAME
@@ -57,244 +253,857 @@ class LegalRAG:
                 self.use_gcs = False
                 logger.warning("Storage client not available. Using local storage only.")
         
-        # Load and prepare the data
-        self.df = self.load_data_from_storage()
-        if self.df is None or len(self.df) == 0:
-            logger.warning("No data loaded. The RAG system may not work properly.")
+        # Locate the knowledge base and fingerprint it; knowledge_version is compared
+        # with knowledge_base_version() to notice new data without downloading it
+        self.knowledge_version = self.knowledge_base_version()
+        self.source_path = self.fetch_data_file()
+        self.source_hash = file_sha256(self.source_path) if self.source_path else None
+        self._end_stage('knowledge_base')
+        
+        # Prefer the prebuilt artifact: no xlsx parsing or document embedding at startup
+        artifact = self.load_index_artifact(refresh_index)
+        if artifact is not None:
+            self.df = None
+            self.documents = artifact.documents
+            self.reducer = DimensionReducer.from_artifact(artifact)
+            self.index = self.load_document_index(artifact)
+            self.question_index = None
+            if 'question_vectors' in artifact.arrays:
+                self.question_index = BruteForceIndex.from_normalized(artifact.arrays['question_vectors'])
+            self.index_version = artifact.version
+            logger.info(f"Loaded retrieval index {artifact.version} with {len(self.documents)} documents")
+            self._end_stage('index_artifact')
+        else:
+            # Reuse the documents prepared on a previous start, else parse the xlsx
+            self.df = None
+            self.documents = self.load_document_cache()
+            if self.documents is None:
+                self.df = self.load_data_from_storage(self.source_path)
+                if self.df is None or len(self.df) == 0:
+                    logger.warning("No data loaded. The RAG system may not work properly.")
+                    
+                self.documents = self.prepare_documents()
+                self.save_document_cache()
             
-        self.documents = self.prepare_documents()
+            # Normalized document/question embedding matrices, built on first search
+            self.reducer = DimensionReducer(EMBEDDING_REDUCTION, EMBEDDING_DIMENSIONS)
+            self.index = None
+            self.question_index = None
+            self.index_version = f"memory-{(self.source_hash or 'unknown')[:8]}"
+            self._end_stage('documents')
         
-        # Cache for embeddings
-        self.embeddings = {}
+        # BM25 inverted index for hybrid and lexical retrieval; cheap to build at startup
+        self.lexical_index = None
+        if RAG_RETRIEVAL_MODE != 'vector':
+            self.lexical_index = BM25Index([doc['combined_text'] for doc in self.documents])
+            logger.info(f"Built lexical index with {len(self.lexical_index.vocabulary)} terms")
+            self._end_stage('lexical_index')
+        self.lexical_fallbacks = 0
         
-        # Try to load embeddings from storage
-        if self.use_gcs:
-            loaded_embeddings = self.load_embeddings_from_storage()
-            if loaded_embeddings:
-                self.embeddings = loaded_embeddings
-                logger.info(f"Loaded {len(self.embeddings)} embeddings from storage")
+        # At most one document index build at a time, and none before index_retry_at
+        self.index_build_lock = threading.Lock()
+        self.index_retry_at = 0.0
+        
+        # Questions answered with NO_INFORMATION_ANSWER because nothing was relevant
+        self.unanswered_queries = 0
+        
+        # Unique questions and the documents answering each, for the FAQ fast path
+        self.questions, self.question_doc_ids = group_questions(self.documents)
+        
+        # Identifies the raw vectors requested from the API in the embedding caches
+        self.embedding_model_id = embedding_model_id(EMBEDDING_MODEL, self.reducer.request_dimensions)
+        
+        # Bounded cache for query embeddings; document embeddings live only in the index
+        self.query_cache = QueryEmbeddingCache(
+            model=self.embedding_model_id,
+            max_size=QUERY_CACHE_SIZE,
+            ttl=QUERY_CACHE_TTL,
+            db_path=QUERY_CACHE_DB
+        )
+        
+        # Estimated prompt sizes, reported by stats()
+        self.prompt_requests = 0
+        self.prompt_tokens_total = 0
+        self.prompt_tokens_max = 0
+        
+        # Answers to recent questions, reused for near-duplicates
+        self.answer_cache = SemanticAnswerCache(
+            threshold=ANSWER_CACHE_THRESHOLD,
+            max_size=ANSWER_CACHE_SIZE
+        )
+        self._end_stage('caches')
+    
+    def _end_stage(self, stage):
+        """Record the time since the previous stage ended as the duration of `stage`."""
+        now = time.perf_counter()
+        self.load_timings[stage] = round(now - self._stage_start, 3)
+        self._stage_start = now
     
-    def load_data_from_storage(self):
-        """Load data from Google Cloud Storage or local file as fallback."""
+    def fetch_data_file(self):
+        """Return a local path to the knowledge-base xlsx, downloading it from GCS if needed."""
         if self.use_gcs:
             try:
                 logger.info("Trying to load data from Google Cloud Storage...")
                 bucket = self.storage_client.bucket(self.bucket_name)
-                blob = bucket.blob('data/legal_questions_answers.xlsx')
-                
-                # Create a temporary file to download to
-                with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as temp_file:
-                    blob.download_to_filename(temp_file.name)
-                    temp_filename = temp_file.name
-                
-                # Load data from temp file
-                df = pd.read_excel(temp_filename)
+                blob = bucket.blob(KNOWLEDGE_BASE_BLOB)
                 
-                # Clean up temp file
-                os.remove(temp_filename)
-                logger.info(f"Successfully loaded {len(df)} rows from Cloud Storage")
-                return df
+                file_path = os.path.join(tempfile.gettempdir(), 'legal_questions_answers.xlsx')
+                download_blob(blob, file_path)
+                logger.info("Successfully downloaded data from Cloud Storage")
+                return file_path
                 
             except Exception as e:
                 logger.error(f"Failed to load from Cloud Storage: {e}")
                 # Fall through to local file loading
         
         # Fallback to local file
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        file_path = os.path.join(base_dir, 'legal_questions_answers.xlsx')
+        
+        # If in development, use local file
+        if os.path.exists(file_path):
+            logger.info(f"Using local data file: {file_path}")
+            return file_path
+        
+        # Try English version as fallback
+        english_file_path = os.path.join(base_dir, 'legal_questions_answers_english.xlsx')
+        if os.path.exists(english_file_path):
+            logger.info(f"Using English local data file: {english_file_path}")
+            return english_file_path
+        
+        logger.error("Could not find data file locally")
+        return None
+    
+    def load_data_from_storage(self, file_path=None):
+        """Load data from Google Cloud Storage or local file as fallback; None on failure."""
+        if file_path is None:
+            file_path = self.fetch_data_file()
+        if file_path is None:
+            return None
+        if not XLSX_SUPPORT:
+            logger.error("pandas and openpyxl are needed to read the knowledge base; ship a prebuilt "
+                         "index (python -m query.build_index) or install requirements-build.txt")
+            return None
+        
         try:
-            logger.info("Loading from local file...")
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            file_path = os.path.join(base_dir, 'legal_questions_answers.xlsx')
-            
-            # If in development, use local file
-            if os.path.exists(file_path):
-                logger.info(f"Loading from local file: {file_path}")
-                return pd.read_excel(file_path)
-            else:
-                # Try English version as fallback
-                english_file_path = os.path.join(base_dir, 'legal_questions_answers_english.xlsx')
-                if os.path.exists(english_file_path):
-                    logger.info(f"Loading from English local file: {english_file_path}")
-                    return pd.read_excel(english_file_path)
-                else:
-                    logger.error("Could not find data file locally")
-                    return pd.DataFrame()  # Return empty DataFrame instead of raising error
+            from .knowledge_base import read_knowledge_base
+            df = read_knowledge_base(file_path)
+            logger.info(f"Successfully loaded {len(df)} rows from {file_path}")
+            return df
         except Exception as e:
-            logger.error(f"Error loading local files: {e}")
-            return pd.DataFrame()  # Return empty DataFrame
+            logger.error(f"Error loading data file: {e}")
+            return None
     
-    def load_embeddings_from_storage(self):
-        """Load embeddings from Google Cloud Storage if available."""
-        if not self.use_gcs:
-            return {}
-            
+    def knowledge_base_version(self):
+        """Cheap fingerprint of the knowledge base and prebuilt index, without downloading them.
+        
+        These are the GCS object generations when Cloud Storage is used, else the
+        local files' modification times; None if they cannot be checked.
+        """
         try:
-            bucket = self.storage_client.bucket(self.bucket_name)
-            blob = bucket.blob('data/embeddings.json')
+            if self.use_gcs:
+                bucket = self.storage_client.bucket(self.bucket_name)
+                blobs = [bucket.get_blob(name) for name in (KNOWLEDGE_BASE_BLOB, INDEX_BLOB)]
+                return tuple(blob.generation if blob is not None else None for blob in blobs)
             
-            if blob.exists():
-                # Download embeddings file
-                with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                    blob.download_to_filename(temp_file.name)
-                    temp_filename = temp_file.name
-                
-                # Load embeddings
-                with open(temp_filename, 'r') as f:
-                    embeddings_data = json.load(f)
-                
-                # Clean up
-                os.remove(temp_filename)
-                
-                # Convert keys to strings and values to lists
-                return {str(k): list(v) for k, v in embeddings_data.items()}
-            return {}
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            paths = [os.path.join(base_dir, 'legal_questions_answers.xlsx'), RAG_INDEX_PATH]
+            return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None for path in paths)
         except Exception as e:
-            logger.error(f"Failed to load embeddings: {e}")
-            return {}
+            logger.error(f"Failed to check the knowledge base version: {e}")
+            return None
     
-    def save_embeddings_to_storage(self):
-        """Save embeddings to Google Cloud Storage."""
-        if not self.use_gcs:
-            return
-            
+    def load_index_artifact(self, refresh=False):
+        """Load the prebuilt retrieval index if it matches the current knowledge base.
+        
+        With GCS, the index is downloaded if there is no local copy, or always
+        with `refresh`.
+        """
+        if self.use_gcs and (refresh or not os.path.exists(RAG_INDEX_PATH)):
+            try:
+                bucket = self.storage_client.bucket(self.bucket_name)
+                blob = bucket.blob(INDEX_BLOB)
+                if blob.exists():
+                    download_blob(blob, RAG_INDEX_PATH)
+            except Exception as e:
+                logger.error(f"Failed to download retrieval index: {e}")
+        
+        if not os.path.exists(RAG_INDEX_PATH):
+            logger.warning(f"No retrieval index at {RAG_INDEX_PATH}; run python -m query.build_index")
+            return None
+        
         try:
-            # Convert to JSON serializable format
-            embeddings_data = {k: list(v) for k, v in self.embeddings.items()}
-            
-            # Create a temporary file
-            with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-                json.dump(embeddings_data, temp_file)
-                temp_filename = temp_file.name
-            
-            # Upload to Cloud Storage
-            bucket = self.storage_client.bucket(self.bucket_name)
-            blob = bucket.blob('data/embeddings.json')
-            blob.upload_from_filename(temp_filename)
+            artifact = RetrievalArtifact.load(RAG_INDEX_PATH)
+        except Exception as e:
+            logger.error(f"Failed to load retrieval index: {e}")
+            return None
+        
+        if artifact.metadata.get('chunking') != CHUNK_SETTINGS:
+            logger.warning(f"Ignoring retrieval index built with chunking {artifact.metadata.get('chunking')}")
+            return None
+        if artifact.model != EMBEDDING_MODEL:
+            logger.warning(f"Ignoring retrieval index built with model {artifact.model}")
+            return None
+        built_with = DimensionReducer.from_artifact(artifact).settings()
+        if built_with != DimensionReducer(EMBEDDING_REDUCTION, EMBEDDING_DIMENSIONS).settings():
+            logger.warning(f"Ignoring retrieval index built with dimension reduction {built_with}")
+            return None
+        if self.source_hash is None:
+            logger.warning("Knowledge base not found; serving the retrieval index as is")
+        elif artifact.source_sha256 != self.source_hash:
+            if not XLSX_SUPPORT:
+                logger.warning("Retrieval index is stale, but the knowledge base cannot be read "
+                               "without pandas/openpyxl; serving the index as is")
+                return artifact
+            logger.warning("Retrieval index is stale (knowledge base changed); rebuilding in memory")
+            return None
+        return artifact
+    
+    def load_embeddings_from_storage(self):
+        """Load the embedding store, refreshing it from Google Cloud Storage if available."""
+        if self.use_gcs:
+            try:
+                bucket = self.storage_client.bucket(self.bucket_name)
+                matrix_blob = bucket.blob(f'data/{MATRIX_FILE}')
+                manifest_blob = bucket.blob(f'data/{MANIFEST_FILE}')
+                
+                if matrix_blob.exists() and manifest_blob.exists():
+                    download_blob(matrix_blob, os.path.join(EMBEDDINGS_DIR, MATRIX_FILE))
+                    download_blob(manifest_blob, os.path.join(EMBEDDINGS_DIR, MANIFEST_FILE))
+                else:
+                    legacy_store = self.load_legacy_embeddings(bucket)
+                    if legacy_store is not None:
+                        return legacy_store
+            except Exception as e:
+                logger.error(f"Failed to load embeddings: {e}")
+        
+        # Memory-map whatever store is available locally
+        return EmbeddingStore.load(EMBEDDINGS_DIR, model=self.embedding_model_id)
+    
+    def load_legacy_embeddings(self, bucket):
+        """Convert a legacy data/embeddings.json blob into the binary store."""
+        blob = bucket.blob('data/embeddings.json')
+        if not blob.exists():
+            return None
+        
+        # Download embeddings file
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            blob.download_to_filename(temp_file.name)
+            temp_filename = temp_file.name
+        
+        with open(temp_filename, 'r') as f:
+            embeddings_data = json.load(f)
+        os.remove(temp_filename)
+        
+        store = EmbeddingStore(model=self.embedding_model_id)
+        store.update(embeddings_data.items())
+        logger.info(f"Converting {len(store)} legacy JSON embeddings to the binary store")
+        self.save_embeddings_to_storage(store)
+        return store
+    
+    def save_embeddings_to_storage(self, store):
+        """Save the document embedding store locally and to Google Cloud Storage."""
+        try:
+            store.save(EMBEDDINGS_DIR)
             
-            # Clean up
-            os.remove(temp_filename)
-            logger.info("Embeddings saved to Cloud Storage")
+            if self.use_gcs:
+                # Upload to Cloud Storage
+                bucket = self.storage_client.bucket(self.bucket_name)
+                for filename in (MATRIX_FILE, MANIFEST_FILE):
+                    blob = bucket.blob(f'data/{filename}')
+                    blob.upload_from_filename(os.path.join(EMBEDDINGS_DIR, filename))
+                logger.info("Embeddings saved to Cloud Storage")
         except Exception as e:
             logger.error(f"Failed to save embeddings: {e}")
         
     def prepare_documents(self):
         """Prepare documents from Excel file."""
-        if self.df is None or self.df.empty:
+        if self.df is None:
             return []
-            
-        documents = []
-        
-        for idx, row in self.df.iterrows():
-            # Get the question
-            question = row['Question']
-            
-            # Combine answers from all sources
-            for i in range(1, 4):
-                try:
-                    if pd.notna(row.get(f'Answer{i}')):
-                        doc = {
-                            'question': question,
-                            'answer': row[f'Answer{i}'],
-                            'source': row.get(f'Site{i}', 'Unknown'),
-                            'combined_text': f"Question: {question}\nAnswer: {row[f'Answer{i}']}"
-                        }
-                        documents.append(doc)
-                except (KeyError, TypeError) as e:
-                    logger.warning(f"Error processing row {idx}, answer {i}: {e}")
-        
-        logger.info(f"Prepared {len(documents)} documents")
+        from .knowledge_base import prepare_documents
+        return compact_documents(prepare_documents(self.df, **CHUNK_SETTINGS))
+    
+    def load_document_cache(self):
+        """Documents cached for the current knowledge base and chunking settings, or None."""
+        if not DOCUMENT_CACHE_PATH or self.source_hash is None:
+            return None
+        documents = load_document_cache(DOCUMENT_CACHE_PATH, self.source_hash, CHUNK_SETTINGS)
+        if documents is not None:
+            logger.info(f"Loaded {len(documents)} prepared documents from {DOCUMENT_CACHE_PATH}")
         return documents
     
+    def save_document_cache(self):
+        """Cache the prepared documents for the next start; failures are only logged."""
+        if not DOCUMENT_CACHE_PATH or self.source_hash is None or not self.documents:
+            return
+        try:
+            save_document_cache(DOCUMENT_CACHE_PATH, self.documents, self.source_hash, CHUNK_SETTINGS)
+            logger.info(f"Cached {len(self.documents)} prepared documents at {DOCUMENT_CACHE_PATH}")
+        except Exception as e:
+            logger.error(f"Failed to cache prepared documents: {e}")
+    
     def get_embedding(self, text):
-        """Get embedding for a text using OpenAI's embedding model."""
-        if text in self.embeddings:
-            return self.embeddings[text]
+        """Get the embedding of a query in index space, using the query cache.
+        
+        Raises if the embedding API fails or times out.
+        """
+        embedding = self.query_cache.get(text)
+        if embedding is None:
+            embedding = self.get_embeddings([text], timeout=QUERY_EMBEDDING_TIMEOUT, max_retries=0)[0]
+            self.query_cache.put(text, embedding)
+        return self.reducer.transform(embedding)[0]
+    
+    def get_embeddings(self, texts, timeout=None, max_retries=None):
+        """Embed many texts with as few API calls as possible (no caching, no reduction).
+        
+        `timeout` and `max_retries` override the client's settings for these calls.
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        client = with_request_options(self.client, timeout, max_retries)
+        vectors = embed_texts(client, unique_texts, model=EMBEDDING_MODEL,
+                              dimensions=self.reducer.request_dimensions)
+        vectors = dict(zip(unique_texts, vectors))
+        return [vectors[text] for text in texts]
+    
+    async def aget_embedding(self, text):
+        """Async variant of get_embedding."""
+        embedding = await self.query_cache.aget(text)
+        if embedding is None:
+            embedding = (await self.aget_embeddings([text], timeout=QUERY_EMBEDDING_TIMEOUT, max_retries=0))[0]
+            await self.query_cache.aput(text, embedding)
+        return self.reducer.transform(embedding)[0]
+    
+    async def aget_embeddings(self, texts, timeout=None, max_retries=None):
+        """Async variant of get_embeddings."""
+        unique_texts = list(dict.fromkeys(texts))
+        client = with_request_options(self.async_client, timeout, max_retries)
+        vectors = await aembed_texts(client, unique_texts, model=EMBEDDING_MODEL,
+                                     dimensions=self.reducer.request_dimensions)
+        vectors = dict(zip(unique_texts, vectors))
+        return [vectors[text] for text in texts]
+    
+    def reload(self):
+        """Build a new LegalRAG from the current knowledge base, ready to serve.
+        
+        The new instance shares this one's OpenAI clients and query embedding
+        cache, and its indexes are built before it is returned, so it can be
+        swapped in without a slow first request. This instance keeps serving
+        meanwhile and is not modified.
+        """
+        rag = LegalRAG(client=self.client, async_client=self.async_client, refresh_index=True)
+        if rag.embedding_model_id == self.embedding_model_id:
+            rag.query_cache = self.query_cache
+        rag.warm_up()
+        return rag
+    
+    def after_fork(self):
+        """Give a forked worker its own connections; the indexes stay shared with the parent.
+        
+        Sockets and SQLite connections must not be used by two processes, so
+        the OpenAI clients and the query cache database are reopened.
+        """
+        self.client, self.async_client = create_openai_clients()
+        self.query_cache.open_db()
+    
+    def warm_up(self):
+        """Build the indexes that would otherwise be built by the first request.
+        
+        If the documents cannot be embedded but a lexical index exists, the
+        document index is left unbuilt: retrieval then falls back to BM25
+        and tries to build it again later (see ensure_document_index).
+        """
+        self._stage_start = time.perf_counter()
+        if self.documents and self.index is None and RAG_RETRIEVAL_MODE != 'lexical':
+            self.ensure_document_index()
+            self._end_stage('document_index')
+        # The FAQ fast path only matches query embeddings, so it is useless without them
+        if FAQ_FAST_PATH and self.questions and self.question_index is None and self.index is not None:
+            self.prepare_faq()
+            self._end_stage('question_index')
+        return self
+    
+    def ensure_document_index(self):
+        """Build the document index if it is missing; returns whether it exists.
+        
+        Only one build runs at a time, and after a failed build the next one
+        waits INDEX_RETRY_SECONDS; callers arriving meanwhile get False
+        without waiting. A failed build raises when there is no lexical index
+        to fall back to.
+        """
+        if self.index is None and self._begin_index_build():
+            try:
+                self.index = self.build_document_index()
+            except Exception as e:
+                self._index_build_failed(e)
+            finally:
+                self.index_build_lock.release()
+        return self.index is not None
+    
+    async def aensure_document_index(self):
+        """Async variant of ensure_document_index."""
+        if self.index is None and self._begin_index_build():
+            try:
+                self.index = await self.abuild_document_index()
+            except Exception as e:
+                self._index_build_failed(e)
+            finally:
+                self.index_build_lock.release()
+        return self.index is not None
+    
+    def _begin_index_build(self):
+        """Take the index build lock if a build should start now."""
+        if time.monotonic() < self.index_retry_at or not self.index_build_lock.acquire(blocking=False):
+            return False
+        if self.index is not None:
+            # Another caller built it since we checked
+            self.index_build_lock.release()
+            return False
+        return True
+    
+    def _index_build_failed(self, error):
+        self.index_retry_at = time.monotonic() + INDEX_RETRY_SECONDS
+        logger.error(f"Document index unavailable, next build in {INDEX_RETRY_SECONDS:g}s: {error}")
+        if self.lexical_index is None:
+            raise error
+    
+    def build_document_index(self):
+        """Embed all documents once and pack them into a normalized matrix."""
+        return self._build_index([doc['combined_text'] for doc in self.documents], "document")
+    
+    async def abuild_document_index(self):
+        """Async variant of build_document_index."""
+        return await self._abuild_index([doc['combined_text'] for doc in self.documents], "document")
+    
+    def build_question_index(self):
+        """Embed every unique knowledge-base question for the FAQ fast path."""
+        return self._build_index(self.questions, "question")
+    
+    async def abuild_question_index(self):
+        """Async variant of build_question_index."""
+        return await self._abuild_index(self.questions, "question")
+    
+    def _build_index(self, texts, kind):
+        """Build an index over `texts`.
+        
+        Embeddings already in the document embedding store are reused and new
+        ones are added to it; the store itself is not kept after the build.
+        """
+        store = self.load_embeddings_from_storage()
+        missing = list(dict.fromkeys(text for text in texts if text not in store))
+        
+        if missing:
+            store.update(zip(missing, self.get_embeddings(
+                missing, timeout=INDEX_BUILD_TIMEOUT, max_retries=0)))
+            self.save_embeddings_to_storage(store)
+        
+        return self._pack_index(store, texts, kind)
+    
+    async def _abuild_index(self, texts, kind):
+        """Async variant of _build_index; storage I/O runs in a worker thread."""
+        store = await asyncio.to_thread(self.load_embeddings_from_storage)
+        missing = list(dict.fromkeys(text for text in texts if text not in store))
+        
+        if missing:
+            store.update(zip(missing, await self.aget_embeddings(
+                missing, timeout=INDEX_BUILD_TIMEOUT, max_retries=0)))
+            await asyncio.to_thread(self.save_embeddings_to_storage, store)
+        
+        return self._pack_index(store, texts, kind)
+    
+    def _pack_index(self, store, texts, kind):
+        # Only the document index is large enough to benefit from another backend
+        backend = RAG_INDEX_BACKEND if kind == "document" else 'flat'
+        vectors = [store[text] for text in texts]
+        if not self.reducer.fitted:
+            self.reducer.fit(vectors)
+        vectors = normalize_rows(self.reducer.transform(vectors))
+        # Never modified after this; read-only pages stay shared between forked workers
+        vectors.flags.writeable = False
+        
+        if backend in QUANTIZED_BACKENDS:
+            # Keep full-precision vectors on disk; only the codes stay in memory.
+            # Written atomically, since a previous index may still map the old file.
+            path = os.path.join(EMBEDDINGS_DIR, f'{kind}_vectors.npy')
+            os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+            atomic_write(path, lambda f: np.save(f, vectors))
+            vectors = np.load(path, mmap_mode='r')
+        
+        index = create_index(vectors, backend, normalized=True, **index_params(backend))
+        logger.info(f"Built {kind} index with {len(index)} vectors ({backend})")
+        return index
+    
+    def load_document_index(self, artifact):
+        """Document index over the artifact's memory-mapped vectors, using RAG_INDEX_BACKEND.
+        
+        Clusters or codes stored in the artifact are used as is; otherwise
+        they are computed at startup.
+        """
+        params = index_params(RAG_INDEX_BACKEND)
+        index = INDEX_CLASSES[RAG_INDEX_BACKEND].from_arrays(artifact.vectors, artifact.arrays, **params)
+        if index is None:
+            logger.info(f"Artifact has no {RAG_INDEX_BACKEND} index data; building it at startup")
+            index = create_index(artifact.vectors, RAG_INDEX_BACKEND, normalized=True, **params)
+        return index
+    
+    def prepare_faq(self):
+        """Build the question index of the FAQ fast path if it is enabled and not built yet."""
+        if FAQ_FAST_PATH and self.questions and self.question_index is None:
+            self.question_index = self.build_question_index()
+    
+    async def aprepare_faq(self):
+        """Async variant of prepare_faq."""
+        if FAQ_FAST_PATH and self.questions and self.question_index is None:
+            self.question_index = await self.abuild_question_index()
+    
+    def match_faq(self, query_embedding):
+        """Answer directly from the knowledge base if the query matches a stored question.
+        
+        Only active with FAQ_FAST_PATH, once prepare_faq has built the question
+        index. Returns a response dict with the stored answers and sites when
+        the best question similarity reaches FAQ_THRESHOLD, otherwise None; no
+        chat completion is made on a hit.
+        """
+        if not FAQ_FAST_PATH or self.question_index is None or query_embedding is None:
+            return None
+        
+        question_ids, scores = self.question_index.search(query_embedding, 1)
+        if len(question_ids) == 0 or scores[0] < FAQ_THRESHOLD:
+            return None
+        
+        # Reassemble each stored answer from its passages
+        answers = {}
+        for doc_id in self.question_doc_ids[question_ids[0]]:
+            doc = self.documents[doc_id]
+            answers.setdefault(doc.get('parent', doc_id), []).append(doc)
+        
+        logger.info(f"FAQ fast path hit (similarity {scores[0]:.3f})")
+        return {
+            'answer': "\n\n".join(
+                join_passages([(doc.get('start', 0), str(doc['answer'])) for doc in passages])
+                for passages in answers.values()
+            ),
+            'sources': list(dict.fromkeys(
+                source for passages in answers.values() for source in passages[0].get('sources', [passages[0]['source']])
+            ))
+        }
+    
+    def find_relevant_documents(self, query, top_k=RAG_TOP_K):
+        """Find most relevant documents for a query."""
+        _, doc_ids = self.retrieve(query, top_k)
+        return [self.documents[i] for i in doc_ids]
+    
+    async def afind_relevant_documents(self, query, top_k=RAG_TOP_K):
+        """Async variant of find_relevant_documents."""
+        _, doc_ids = await self.aretrieve(query, top_k)
+        return [self.documents[i] for i in doc_ids]
+    
+    def retrieve(self, query, top_k=RAG_TOP_K):
+        """Embed a query and search the index; returns `(query_embedding, doc_ids)`.
+        
+        The embedding is None when only lexical retrieval was used. If the
+        embedding API fails, this falls back to BM25 when a lexical index
+        exists and raises otherwise, so an outage is not mistaken for a
+        question the knowledge base cannot answer.
+        """
+        if not self.documents:
+            logger.warning("No documents available for search")
+            return None, []
+        
+        if RAG_RETRIEVAL_MODE == 'lexical':
+            return None, self.search_lexical(query, top_k)
+        
+        if not self.ensure_document_index():
+            if self.lexical_index is None:
+                raise RuntimeError("Document index unavailable; waiting to retry the build")
+            return self._lexical_fallback(query, top_k)
         
         try:
-            response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            embedding = response.data[0].embedding
-            self.embeddings[text] = embedding
-            
-            # Periodically save embeddings (every 10 new embeddings)
-            if self.use_gcs and len(self.embeddings) % 10 == 0:
-                self.save_embeddings_to_storage()
-                
-            return embedding
+            query_embedding = self.get_embedding(query)
         except Exception as e:
-            logger.error(f"Error getting embedding: {e}")
-            # Return a random embedding for graceful degradation
-            return [0.0] * 1536  # Default embedding dimension
+            if self.lexical_index is None:
+                raise
+            logger.error(f"Query embedding unavailable: {e}")
+            return self._lexical_fallback(query, top_k)
+        return self._search(query, query_embedding, top_k)
     
-    def find_relevant_documents(self, query, top_k=3):
-        """Find most relevant documents for a query."""
+    async def aretrieve(self, query, top_k=RAG_TOP_K):
+        """Async variant of retrieve."""
         if not self.documents:
             logger.warning("No documents available for search")
-            return []
-            
-        query_embedding = self.get_embedding(query)
+            return None, []
+        
+        if RAG_RETRIEVAL_MODE == 'lexical':
+            return None, self.search_lexical(query, top_k)
         
-        # Get embeddings for all documents
-        doc_embeddings = [self.get_embedding(doc['combined_text']) 
-                         for doc in self.documents]
+        if not await self.aensure_document_index():
+            if self.lexical_index is None:
+                raise RuntimeError("Document index unavailable; waiting to retry the build")
+            return self._lexical_fallback(query, top_k)
         
-        # Calculate similarities
-        similarities = cosine_similarity(
-            [query_embedding],
-            doc_embeddings
-        )[0]
+        try:
+            query_embedding = await self.aget_embedding(query)
+        except Exception as e:
+            if self.lexical_index is None:
+                raise
+            logger.error(f"Query embedding unavailable: {e}")
+            return self._lexical_fallback(query, top_k)
+        return self._search(query, query_embedding, top_k)
+    
+    def _search(self, query, query_embedding, top_k):
+        if self.lexical_index is None:
+            return query_embedding, self.search_documents(query_embedding, top_k)
+        return query_embedding, self.search_hybrid(query, query_embedding, top_k)
+    
+    def _lexical_fallback(self, query, top_k):
+        self.lexical_fallbacks += 1
+        logger.warning("Embeddings unavailable; using lexical retrieval only")
+        return None, self.search_lexical(query, top_k)
+    
+    def search_documents(self, query_embedding, top_k=RAG_TOP_K):
+        """Ids of the relevant documents, at most `top_k`, closest to a query embedding."""
+        top_ids, scores = self.index.search(query_embedding, top_k)
+        return select_relevant(top_ids, scores, top_k, RAG_MIN_SCORE, RAG_SCORE_MARGIN)
+    
+    def search_lexical(self, query, top_k=RAG_TOP_K):
+        """Ids of the relevant documents, at most `top_k`, with the best BM25 score for the query."""
+        top_ids, scores = self.lexical_index.search(query, top_k)
+        return select_relevant(top_ids, scores, top_k, ratio=RAG_LEXICAL_RATIO)
+    
+    def search_hybrid(self, query, query_embedding, top_k=RAG_TOP_K):
+        """Ids of the relevant documents, at most `top_k`, after fusing the vector and BM25 rankings.
+        
+        The fused ranking is thresholded on the documents' cosine similarity,
+        so a BM25 match alone does not make an off-topic question answerable.
+        """
+        candidates = max(4 * top_k, 20)
+        fused = fuse(
+            [self.index.search(query_embedding, candidates), self.lexical_index.search(query, candidates)],
+            method=RAG_FUSION,
+            weights=[RAG_HYBRID_ALPHA, 1 - RAG_HYBRID_ALPHA],
+            top_k=top_k
+        )
+        return select_relevant(fused, self.index.similarities(query_embedding, fused), top_k,
+                               RAG_MIN_SCORE, RAG_SCORE_MARGIN)
+    
+    def stats(self):
+        """Index and cache counters for monitoring."""
+        return {
+            'index_version': self.index_version,
+            'documents': len(self.documents),
+            'index_backend': RAG_INDEX_BACKEND,
+            'retrieval_mode': RAG_RETRIEVAL_MODE,
+            'lexical_fallbacks': self.lexical_fallbacks,
+            'unanswered_queries': self.unanswered_queries,
+            'index_memory_bytes': self.index.memory_bytes if self.index is not None else 0,
+            'query_cache': self.query_cache.stats(),
+            'answer_cache': self.answer_cache.stats(),
+            'prompt_tokens': {
+                'requests': self.prompt_requests,
+                'average': self.prompt_tokens_total / self.prompt_requests if self.prompt_requests else 0.0,
+                'max': self.prompt_tokens_max,
+                'context_budget': CONTEXT_TOKEN_BUDGET
+            }
+        }
+    
+    def prepare_prompt(self, query, doc_ids, history=None):
+        """Pack the retrieved documents into the context budget and build the messages.
+        
+        Returns `(messages, context, prompt_tokens)`; the token count is an
+        offline estimate and is also added to the prompt statistics. When no
+        passage fits the budget there is nothing to ask the model about, and
+        `messages` is None.
+        """
+        context = pack_context(self.documents, doc_ids, CONTEXT_TOKEN_BUDGET)
+        if not context.text:
+            logger.info(f"No passage of {len(doc_ids)} fits the context budget of {CONTEXT_TOKEN_BUDGET} tokens")
+            return None, context, 0
+        messages = self.build_messages(query, context.text, history)
+        prompt_tokens = estimate_message_tokens(messages)
+        
+        self.prompt_requests += 1
+        self.prompt_tokens_total += prompt_tokens
+        self.prompt_tokens_max = max(self.prompt_tokens_max, prompt_tokens)
+        logger.info(
+            f"Prompt ~{prompt_tokens} tokens: {context.tokens} context tokens from "
+            f"{len(context.doc_ids)}/{len(doc_ids)} passages{' (truncated)' if context.truncated else ''}"
+        )
+        return messages, context, prompt_tokens
+    
+    def build_messages(self, query, context, history=None):
+        """Build the chat-completion messages for a query, its packed context and prior turns."""
+        # Create prompt for GPT
+        prompt = f"""Based on the following context, answer the question. 
+        If the context doesn't contain relevant information, say so.
+        
+        Context:
+        {context}
+        
+        Question: {query}
+        
+        Answer:"""
         
-        # Get top-k most similar documents
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        return [self.documents[i] for i in top_indices]
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            *build_chat_history(history),
+            {"role": "user", "content": prompt}
+        ]
     
-    def generate_response(self, query):
-        """Generate a response using RAG."""
+    def _short_circuit(self, query_embedding, doc_ids, history=None):
+        """Response to a question that needs no chat completion, or None.
+        
+        That is a question without relevant documents, a FAQ fast-path match
+        or a semantic answer cache hit. Shared by the sync, async and
+        streaming paths, which call (a)prepare_faq first.
+        """
+        if not doc_ids:
+            return self._no_information()
+        
+        faq = self.match_faq(query_embedding)
+        if faq is not None:
+            return faq
+        
+        # Answers written with a conversation's earlier turns may depend on them
+        # (and on personal details given there), so they are never shared
+        if build_chat_history(history):
+            return None
+        cached = self.answer_cache.lookup(query_embedding, doc_ids, self.index_version)
+        if cached is not None:
+            return {'answer': cached.answer, 'sources': cached.sources}
+        return None
+    
+    def _no_information(self):
+        """The response to a question that no document can answer."""
+        self.unanswered_queries += 1
+        return {'answer': NO_INFORMATION_ANSWER, 'sources': []}
+    
+    def _store_answer(self, query_embedding, doc_ids, history, answer, sources, start):
+        """Cache a generated answer unless prior turns were part of its prompt.
+        
+        `start` is when its chat completion was requested.
+        """
+        if build_chat_history(history):
+            return
+        self.answer_cache.store(query_embedding, doc_ids, answer, sources,
+                                time.perf_counter() - start, self.index_version)
+    
+    def generate_response(self, query, history=None):
+        """Generate a response using RAG.
+        
+        `history` is the list of earlier conversation messages (dicts with
+        `role` and `content`); it is sent to the LLM as chat turns, while only
+        the question itself drives retrieval.
+        
+        Near-duplicate questions that retrieve the same documents are answered
+        from the semantic answer cache without calling the LLM; questions asked
+        with a history neither use nor fill the cache.
+        """
         try:
             # Find relevant documents
-            relevant_docs = self.find_relevant_documents(query)
+            query_embedding, doc_ids = self.retrieve(build_retrieval_query(query, history))
+            if doc_ids and query_embedding is not None:
+                self.prepare_faq()
             
-            if not relevant_docs:
-                return {
-                    'answer': "I'm sorry, but I don't have enough information in my database to answer your question accurately. Please try a different question or contact a legal advisor for assistance.",
-                    'sources': []
-                }
+            result = self._short_circuit(query_embedding, doc_ids, history)
+            if result is not None:
+                return result
             
-            # Prepare context from relevant documents
-            context = "\n\n".join([
-                f"Source: {doc['source']}\n{doc['answer']}" 
-                for doc in relevant_docs
-            ])
+            messages, context, prompt_tokens = self.prepare_prompt(query, doc_ids, history)
+            if messages is None:
+                return self._no_information()
             
-            # Create prompt for GPT
-            prompt = f"""Based on the following context, answer the question. 
-            If the context doesn't contain relevant information, say so.
+            # Generate response using GPT-3.5-turbo
+            start = time.perf_counter()
+            response = self.client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                temperature=0.7
+            )
             
-            Context:
-            {context}
+            result = {
+                'answer': response.choices[0].message.content,
+                'sources': context.sources,
+                'prompt_tokens': prompt_tokens
+            }
+            self._store_answer(query_embedding, doc_ids, history, result['answer'], result['sources'], start)
+            return result
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            return {'answer': ERROR_ANSWER, 'sources': []}
+    
+    async def agenerate_response(self, query, history=None):
+        """Async variant of generate_response that never blocks the event loop on HTTP."""
+        try:
+            # Find relevant documents
+            query_embedding, doc_ids = await self.aretrieve(build_retrieval_query(query, history))
+            if doc_ids and query_embedding is not None:
+                await self.aprepare_faq()
             
-            Question: {query}
+            result = self._short_circuit(query_embedding, doc_ids, history)
+            if result is not None:
+                return result
             
-            Answer:"""
+            messages, context, prompt_tokens = self.prepare_prompt(query, doc_ids, history)
+            if messages is None:
+                return self._no_information()
             
-            # Generate response using GPT-3.5-turbo
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful legal assistant specializing in Polish law. Provide accurate, clear answers based on the given context."},
-                    {"role": "user", "content": prompt}
-                ],
+            start = time.perf_counter()
+            response = await self.async_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
                 temperature=0.7
             )
             
-            return {
+            result = {
                 'answer': response.choices[0].message.content,
-                'sources': [doc['source'] for doc in relevant_docs]
+                'sources': context.sources,
+                'prompt_tokens': prompt_tokens
             }
+            self._store_answer(query_embedding, doc_ids, history, result['answer'], result['sources'], start)
+            return result
         except Exception as e:
             logger.error(f"Error generating response: {e}")
-            return {
-                'answer': "I'm sorry, I encountered an error while processing your request. Please try again later.",
-                'sources': []
-            }
+            return {'answer': ERROR_ANSWER, 'sources': []}
+    
+    async def astream_response(self, query, history=None):
+        """Stream a RAG response as events: one 'sources' event, then 'token' events.
+        
+        If anything fails, a final 'error' event (with ERROR_ANSWER as its
+        `message`) ends the stream; tokens already sent are an incomplete answer.
+        """
+        try:
+            # Find relevant documents
+            query_embedding, doc_ids = await self.aretrieve(build_retrieval_query(query, history))
+            if doc_ids and query_embedding is not None:
+                await self.aprepare_faq()
+            
+            result = self._short_circuit(query_embedding, doc_ids, history)
+            if result is not None:
+                yield {'type': 'sources', 'sources': result['sources']}
+                yield {'type': 'token', 'content': result['answer']}
+                return
+            
+            messages, context, prompt_tokens = self.prepare_prompt(query, doc_ids, history)
+            if messages is None:
+                yield {'type': 'sources', 'sources': []}
+                yield {'type': 'token', 'content': self._no_information()['answer']}
+                return
+            sources = context.sources
+            yield {'type': 'sources', 'sources': sources, 'prompt_tokens': prompt_tokens}
+            
+            start = time.perf_counter()
+            stream = await self.async_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                temperature=0.7,
+                stream=True
+            )
+            answer_parts = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    answer_parts.append(chunk.choices[0].delta.content)
+                    yield {'type': 'token', 'content': chunk.choices[0].delta.content}
+            
+            self._store_answer(query_embedding, doc_ids, history, "".join(answer_parts), sources, start)
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            yield {'type': 'error', 'message': ERROR_ANSWER}
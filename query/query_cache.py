@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .embeddings import EMBEDDING_MODEL
+
+logger = logging.getLogger('legal_rag')
+
+
+def normalize_query(text):
+    """Case- and whitespace-insensitive form of a query, used for cache keys."""
+    return ' '.join(text.casefold().split())
+
+
+class QueryEmbeddingCache:
+    """Bounded two-tier cache of query embeddings.
+
+    The first tier is an in-memory LRU limited to `max_size` entries; the
+    optional second tier is a SQLite file at `db_path` limited to
+    `max_disk_size` rows. Entries in both tiers expire after `ttl` seconds.
+    Keys are hashes of the model name and the normalized query text, so
+    trivially different spellings of the same question share an entry.
+
+    The async methods run SQLite I/O in a worker thread, so a slow disk does
+    not stall the event loop; `lock` only guards the in-memory tier and
+    `db_lock` the connection.
+    """
+
+    def __init__(self, model=EMBEDDING_MODEL, max_size=1024, ttl=86400,
+                 db_path=None, max_disk_size=100000):
+        self.model = model
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_disk_size = max_disk_size
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        self.db_path = db_path
+        self.disk_writes = 0
+        self.open_db()
+
+    def open_db(self):
+        """(Re)connect to the SQLite tier, e.g. in a forked worker, which must not
+        share its parent's connection."""
+        if not self.db_path:
+            return
+        try:
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS query_embeddings_created_at "
+                "ON query_embeddings (created_at)"
+            )
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open query cache database {self.db_path}: {e}")
+            self.db = None
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\n{normalize_query(text)}".encode('utf-8')).hexdigest()
+
+    def get(self, text):
+        """Return the cached embedding for `text`, or None."""
+        key = self.key(text)
+        now = time.time()
+        vector = self._memory_get(key, now)
+        if vector is None:
+            vector = self._disk_lookup(key, now)
+        return vector
+
+    async def aget(self, text):
+        """Async variant of get."""
+        key = self.key(text)
+        now = time.time()
+        vector = self._memory_get(key, now)
+        if vector is None and self.db is None:
+            vector = self._disk_lookup(key, now)
+        elif vector is None:
+            vector = await asyncio.to_thread(self._disk_lookup, key, now)
+        return vector
+
+    def put(self, text, vector):
+        key = self.key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        now = time.time()
+
+        with self.lock:
+            self._memory_put(key, vector, now)
+        self._disk_put(key, vector, now)
+
+    async def aput(self, text, vector):
+        """Async variant of put."""
+        key = self.key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        now = time.time()
+
+        with self.lock:
+            self._memory_put(key, vector, now)
+        if self.db is not None:
+            await asyncio.to_thread(self._disk_put, key, vector, now)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'size': len(self.memory),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def _memory_get(self, key, now):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                return None
+            vector, created_at = entry
+            if now - created_at <= self.ttl:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+            del self.memory[key]
+            return None
+
+    def _disk_lookup(self, key, now):
+        """Look `key` up in the SQLite tier after a memory miss, promoting a hit to memory."""
+        vector, created_at = self._disk_get(key, now)
+        with self.lock:
+            if vector is None:
+                self.misses += 1
+                return None
+            self._memory_put(key, vector, created_at)
+            self.disk_hits += 1
+            return vector
+
+    def _memory_put(self, key, vector, created_at):
+        self.memory[key] = (vector, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if self.db is None:
+            return None, None
+        try:
+            with self.db_lock:
+                row = self.db.execute(
+                    "SELECT vector, created_at FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None, None
+                if now - row[1] > self.ttl:
+                    self.db.execute("DELETE FROM query_embeddings WHERE key = ?", (key,))
+                    self.db.commit()
+                    return None, None
+            return np.frombuffer(row[0], dtype=np.float32), row[1]
+        except sqlite3.Error as e:
+            logger.error(f"Query cache read failed: {e}")
+            return None, None
+
+    def _disk_put(self, key, vector, created_at):
+        if self.db is None:
+            return
+        try:
+            with self.db_lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                    (key, vector.tobytes(), created_at)
+                )
+                # Periodically drop expired rows and keep the table within its size limit
+                self.disk_writes += 1
+                if self.disk_writes % 100 == 0:
+                    self.db.execute("DELETE FROM query_embeddings WHERE created_at < ?", (created_at - self.ttl,))
+                    self.db.execute(
+                        "DELETE FROM query_embeddings WHERE key IN (SELECT key FROM query_embeddings "
+                        "ORDER BY created_at DESC LIMIT -1 OFFSET ?)", (self.max_disk_size,)
+                    )
+                self.db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Query cache write failed: {e}")
@@ -1,4 +1,4 @@
-from prepare_rag import LegalRAG
+from query.prepare_rag import LegalRAG
 
 def query_rag():
     # Initialize the RAG system
@@ -0,0 +1,91 @@
+import numpy as np
+
+REDUCTION_METHODS = ('api', 'truncate', 'pca')
+
+# Rows used to fit PCA; the covariance of a larger sample barely changes
+PCA_SAMPLE_SIZE = 50000
+
+
+class DimensionReducer:
+    """Maps embeddings to the dimensionality of the retrieval index.
+
+    `dimensions=None` keeps full-size embeddings. Otherwise `method` is one of:
+
+    - 'api': the embeddings endpoint is asked for `dimensions`-sized vectors
+      (supported by the text-embedding-3 models), so nothing happens locally;
+    - 'truncate': full vectors are requested and their first `dimensions`
+      components kept, for models without the `dimensions` parameter;
+    - 'pca': full vectors are projected onto the top `dimensions` principal
+      components of the document embeddings, fitted at index build time.
+
+    Outputs are not normalized; the vector indexes normalize their inputs.
+    """
+
+    def __init__(self, method='api', dimensions=None, mean=None, components=None):
+        if method not in REDUCTION_METHODS:
+            raise ValueError(f"Unknown reduction method {method!r}; expected one of {REDUCTION_METHODS}")
+        self.method = method if dimensions else 'api'
+        self.dimensions = dimensions or None
+        self.mean = mean
+        self.components = components
+
+    @property
+    def request_dimensions(self):
+        """The `dimensions` parameter for embeddings requests, or None for full vectors."""
+        return self.dimensions if self.method == 'api' else None
+
+    @property
+    def fitted(self):
+        return self.method != 'pca' or self.components is not None
+
+    def settings(self):
+        """`(method, dimensions)`; two reducers with equal settings produce compatible vectors."""
+        return self.method, self.dimensions
+
+    def fit(self, vectors):
+        """Fit the PCA projection to full-size `vectors`; a no-op for other methods."""
+        if self.method != 'pca':
+            return self
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dimensions > vectors.shape[1]:
+            raise ValueError(f"Cannot reduce {vectors.shape[1]} dimensions to {self.dimensions}")
+        if len(vectors) > PCA_SAMPLE_SIZE:
+            rng = np.random.default_rng(0)
+            vectors = vectors[np.sort(rng.choice(len(vectors), PCA_SAMPLE_SIZE, replace=False))]
+
+        # Eigenvectors of the d x d covariance: cheaper than an SVD of the data when rows > d
+        mean = vectors.mean(axis=0)
+        centered = vectors - mean
+        _, eigenvectors = np.linalg.eigh(centered.T @ centered)
+        self.mean = mean.astype(np.float32)
+        self.components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :self.dimensions].T, dtype=np.float32)
+        return self
+
+    def transform(self, vectors):
+        """Reduce a vector or a matrix of vectors; returns a float32 matrix."""
+        vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+        if self.method == 'truncate':
+            return vectors[:, :self.dimensions]
+        if self.method == 'pca':
+            if self.components is None:
+                raise ValueError("PCA reducer used before fit()")
+            return (vectors - self.mean) @ self.components.T
+        return vectors
+
+    def to_arrays(self):
+        if self.method != 'pca':
+            return {}
+        return {'pca_mean': self.mean, 'pca_components': self.components}
+
+    def metadata(self):
+        return {'reduction': self.method, 'reduced_dimensions': self.dimensions}
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        """The reducer an artifact's vectors were built with."""
+        return cls(
+            artifact.metadata.get('reduction', 'api'),
+            artifact.metadata.get('reduced_dimensions'),
+            mean=artifact.arrays.get('pca_mean'),
+            components=artifact.arrays.get('pca_components'),
+        )
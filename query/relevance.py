@@ -0,0 +1,29 @@
+"""Decide how many retrieved documents are relevant enough to answer from."""
+import numpy as np
+
+
+def relevance_cutoff(best_score, min_score=0.0, margin=None, ratio=None):
+    """Lowest score worth keeping when the best candidate scored `best_score`.
+
+    This is the absolute floor `min_score`, raised to stay within `margin` of
+    the best score and/or to at least `ratio` times it. A clear winner then
+    keeps only its close rivals, while a flat score distribution keeps more.
+    """
+    cutoff = min_score
+    if margin is not None:
+        cutoff = max(cutoff, best_score - margin)
+    if ratio is not None:
+        cutoff = max(cutoff, best_score * ratio)
+    return cutoff
+
+
+def select_relevant(ids, scores, max_k, min_score=0.0, margin=None, ratio=None):
+    """Ids, in ranking order, whose score clears the relevance cutoff; at most `max_k`.
+
+    Returns [] when no candidate reaches `min_score`.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    if len(scores) == 0 or scores.max() < min_score:
+        return []
+    cutoff = relevance_cutoff(float(scores.max()), min_score, margin, ratio)
+    return [int(doc_id) for doc_id, score in zip(ids, scores) if score >= cutoff][:max_k]
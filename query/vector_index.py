@@ -0,0 +1,483 @@
+import numpy as np
+
+INDEX_BACKENDS = ('flat', 'ivf', 'int8', 'pq')
+# Backends that keep compact codes in memory and rerank against full vectors
+QUANTIZED_BACKENDS = ('int8', 'pq')
+
+
+def normalize_rows(matrix):
+    """Return a float32 copy of `matrix` with every row scaled to unit L2 norm.
+
+    Zero rows are left as zeros instead of producing NaNs.
+    """
+    matrix = np.array(matrix, dtype=np.float32, ndmin=2, order='C')
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def top_k_indices(scores, top_k):
+    """Indices of the `top_k` highest scores, best first, without a full sort."""
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(scores, -top_k)[-top_k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+class VectorIndex:
+    """Cosine-similarity search over a fixed set of L2-normalized vectors.
+
+    Subclasses keep `vectors` (one row per indexed item) and `ids` (the id
+    returned for each row) and implement `search`. `to_arrays` and
+    `from_arrays` save and restore any trained state (clusters, codes) as
+    named arrays, e.g. in the retrieval artifact.
+    """
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def dimensions(self):
+        return self.vectors.shape[1]
+
+    @property
+    def memory_bytes(self):
+        """Bytes of index data that are read on every search."""
+        return self.vectors.nbytes
+
+    def search(self, query_vector, top_k=3):
+        """Return `(ids, scores)` of the `top_k` most similar rows, best first."""
+        raise NotImplementedError
+
+    def similarities(self, query_vector, ids):
+        """Exact cosine similarity of the query to the rows with the given `ids`."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return np.empty(0, dtype=np.float32)
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind='stable')
+        rows = self._id_order[np.searchsorted(self.ids, ids, sorter=self._id_order)]
+
+        # Memory maps are read in row order, then scores are put back in the order of `ids`
+        order = np.argsort(rows)
+        scores = np.empty(len(rows), dtype=np.float32)
+        scores[order] = np.asarray(self.vectors[rows[order]], dtype=np.float32) @ normalize_rows(query_vector)[0]
+        return scores
+
+    def to_arrays(self):
+        return {}
+
+    @classmethod
+    def from_arrays(cls, vectors, arrays, ids=None, **params):
+        """Restore an index saved with `to_arrays`, or None if `arrays` lacks its state."""
+        return None
+
+    @staticmethod
+    def _empty_result():
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    def _init_ids(self, ids):
+        if ids is None:
+            ids = np.arange(len(self.vectors), dtype=np.int64)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        if len(self.ids) != len(self.vectors):
+            raise ValueError("Number of ids does not match number of vectors")
+        # Row position of every id, sorted by id; built on the first similarities() call
+        self._id_order = None
+
+
+class BruteForceIndex(VectorIndex):
+    """Exact index: every query is scored against every row.
+
+    The embeddings are stored once as a contiguous, L2-normalized float32 matrix
+    so that a query costs a single matrix-vector product plus a partial sort.
+    """
+
+    def __init__(self, vectors, ids=None):
+        self.vectors = normalize_rows(vectors)
+        self._init_ids(ids)
+
+    @classmethod
+    def from_normalized(cls, vectors, ids=None):
+        """Wrap an already L2-normalized float32 matrix (e.g. a memory map) without copying."""
+        index = cls.__new__(cls)
+        index.vectors = vectors
+        index._init_ids(ids)
+        return index
+
+    @classmethod
+    def from_arrays(cls, vectors, arrays, ids=None, **params):
+        return cls.from_normalized(vectors, ids=ids)
+
+    def search(self, query_vector, top_k=3):
+        if len(self) == 0:
+            return self._empty_result()
+
+        query = normalize_rows(query_vector)[0]
+        scores = self.vectors @ query
+        best = top_k_indices(scores, top_k)
+        return self.ids[best], scores[best]
+
+
+def kmeans(vectors, n_clusters, iterations=20, sample_size=None, seed=0, spherical=False):
+    """k-means centroids of the rows of `vectors`.
+
+    With `spherical=True` the rows must be L2-normalized, points go to the
+    centroid with the highest dot product and centroids are kept at unit
+    norm; otherwise plain Euclidean k-means is used. Training uses a random
+    sample of at most `sample_size` rows (default 64 per cluster); empty
+    clusters are re-seeded from random sample points.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, min(n_clusters, len(vectors)))
+    if sample_size is None:
+        sample_size = 64 * n_clusters
+    if len(vectors) > sample_size:
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    else:
+        sample = np.asarray(vectors)
+    sample = np.ascontiguousarray(sample, dtype=np.float32)
+
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign_clusters(sample, centroids, spherical=spherical)
+        counts = np.bincount(assignment, minlength=n_clusters)
+
+        # Per-cluster sums of the sorted sample; reduceat is much faster than np.add.at
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums[filled] = np.add.reduceat(sample[np.argsort(assignment, kind='stable')], starts[filled])
+
+        empty = ~filled
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+            counts[empty] = 1
+        centroids = normalize_rows(sums) if spherical else sums / counts[:, None]
+    return centroids
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=20, sample_size=None, seed=0):
+    """Unit-norm k-means centroids of L2-normalized `vectors`."""
+    return kmeans(vectors, n_clusters, iterations, sample_size, seed, spherical=True)
+
+
+def assign_clusters(vectors, centroids, chunk_size=65536, spherical=True):
+    """Index of the closest centroid for each row, computed in chunks."""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    if not spherical:
+        # argmin |x - c|^2 == argmax (x.c - |c|^2 / 2)
+        half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    for start in range(0, len(vectors), chunk_size):
+        scores = np.asarray(vectors[start:start + chunk_size]) @ centroids.T
+        if not spherical:
+            scores -= half_norms
+        assignment[start:start + chunk_size] = np.argmax(scores, axis=1)
+    return assignment
+
+
+class IVFIndex(VectorIndex):
+    """Approximate inverted-file index.
+
+    Rows are partitioned into `nlist` clusters by spherical k-means. A query
+    is scored against the centroids first and then only against the rows of
+    the `nprobe` closest clusters, so its cost grows with
+    `nprobe / nlist` of the corpus instead of all of it. `nprobe >= nlist`
+    gives exact results.
+
+    The inverted lists are stored as `list_rows`, the row numbers grouped by
+    cluster, and `list_offsets`, where cluster `c` owns
+    `list_rows[list_offsets[c]:list_offsets[c + 1]]`. Rows stay in their
+    original order, so `vectors` can be a memory map shared with other indexes.
+    """
+
+    def __init__(self, vectors, ids=None, nlist=None, nprobe=8, iterations=20, seed=0):
+        self._train(normalize_rows(vectors), ids, nlist, nprobe, iterations, seed)
+
+    @classmethod
+    def from_normalized(cls, vectors, ids=None, nlist=None, nprobe=8, iterations=20, seed=0):
+        """Cluster an already L2-normalized matrix (e.g. a memory map) without copying it."""
+        index = cls.__new__(cls)
+        index._train(vectors, ids, nlist, nprobe, iterations, seed)
+        return index
+
+    def _train(self, vectors, ids, nlist, nprobe, iterations, seed):
+        if nlist is None:
+            nlist = default_nlist(len(vectors))
+        if len(vectors) == 0:
+            centroids = np.empty((0, vectors.shape[1]), dtype=np.float32)
+        else:
+            centroids = spherical_kmeans(vectors, nlist, iterations=iterations, seed=seed)
+        list_rows, list_offsets = build_inverted_lists(vectors, centroids)
+        self._setup(vectors, ids, centroids, list_rows, list_offsets, nprobe)
+
+    @classmethod
+    def from_parts(cls, vectors, centroids, list_rows, list_offsets, ids=None, nprobe=8):
+        """Wrap prebuilt clusters (e.g. memory maps from an artifact) without copying."""
+        index = cls.__new__(cls)
+        index._setup(vectors, ids, centroids, list_rows, list_offsets, nprobe)
+        return index
+
+    @classmethod
+    def from_arrays(cls, vectors, arrays, ids=None, nprobe=8, **params):
+        if 'ivf_centroids' not in arrays:
+            return None
+        return cls.from_parts(vectors, arrays['ivf_centroids'], arrays['ivf_list_rows'],
+                              arrays['ivf_list_offsets'], ids=ids, nprobe=nprobe)
+
+    def to_arrays(self):
+        return {
+            'ivf_centroids': self.centroids,
+            'ivf_list_rows': self.list_rows,
+            'ivf_list_offsets': self.list_offsets,
+        }
+
+    def _setup(self, vectors, ids, centroids, list_rows, list_offsets, nprobe):
+        self.vectors = vectors
+        self._init_ids(ids)
+        self.centroids = centroids
+        self.list_rows = list_rows
+        self.list_offsets = list_offsets
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def memory_bytes(self):
+        return self.vectors.nbytes + self.centroids.nbytes + self.list_rows.nbytes
+
+    def search(self, query_vector, top_k=3, nprobe=None):
+        if len(self) == 0:
+            return self._empty_result()
+
+        query = normalize_rows(query_vector)[0]
+        clusters = top_k_indices(self.centroids @ query, nprobe or self.nprobe)
+        rows = np.concatenate([
+            self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in clusters
+        ])
+        if len(rows) == 0:
+            return self._empty_result()
+
+        scores = self.vectors[rows] @ query
+        best = top_k_indices(scores, top_k)
+        return self.ids[rows[best]], scores[best]
+
+
+def default_nlist(count):
+    """Number of IVF clusters for `count` rows: about 4 * sqrt(count)."""
+    return max(1, int(4 * np.sqrt(count)))
+
+
+def build_inverted_lists(vectors, centroids):
+    """Group row numbers by nearest centroid; returns `(list_rows, list_offsets)`."""
+    assignment = assign_clusters(vectors, centroids)
+    list_rows = np.argsort(assignment, kind='stable').astype(np.int64)
+    counts = np.bincount(assignment, minlength=len(centroids))
+    list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return list_rows, list_offsets
+
+
+class QuantizedIndex(VectorIndex):
+    """Base for indexes that scan compact codes and rerank with full vectors.
+
+    Subclasses compute approximate scores for every row from their codes; the
+    `rerank` best rows are then rescored exactly against `vectors`. When
+    `vectors` is a memory map (e.g. the artifact), only the pages holding
+    those candidate rows are read, so the resident index is just the codes.
+    """
+
+    chunk_size = 8192
+
+    def _setup(self, vectors, ids, rerank):
+        self.vectors = vectors
+        self._init_ids(ids)
+        self.rerank = rerank
+
+    @property
+    def memory_bytes(self):
+        return sum(array.nbytes for array in self.to_arrays().values())
+
+    def approximate_scores(self, query):
+        """Approximate similarity of every row to the normalized `query`."""
+        raise NotImplementedError
+
+    def search(self, query_vector, top_k=3, rerank=None):
+        if len(self) == 0:
+            return self._empty_result()
+
+        query = normalize_rows(query_vector)[0]
+        candidates = top_k_indices(self.approximate_scores(query), max(top_k, rerank or self.rerank))
+        # Ascending row order keeps reads from a memory-mapped matrix sequential
+        candidates.sort()
+
+        scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+        best = top_k_indices(scores, top_k)
+        return self.ids[candidates[best]], scores[best]
+
+
+class Int8Index(QuantizedIndex):
+    """int8 scalar quantization: one byte per dimension, 4x smaller than float32.
+
+    Every dimension is scaled by its largest absolute value in the corpus so
+    that it spans [-127, 127].
+    """
+
+    def __init__(self, vectors, ids=None, rerank=50):
+        self._quantize(normalize_rows(vectors), ids, rerank)
+
+    @classmethod
+    def from_normalized(cls, vectors, ids=None, rerank=50):
+        """Quantize an already L2-normalized matrix (e.g. a memory map) without copying it."""
+        index = cls.__new__(cls)
+        index._quantize(vectors, ids, rerank)
+        return index
+
+    @classmethod
+    def from_parts(cls, vectors, codes, scale, ids=None, rerank=50):
+        index = cls.__new__(cls)
+        index._setup(vectors, ids, rerank)
+        index.codes = codes
+        index.scale = scale
+        return index
+
+    @classmethod
+    def from_arrays(cls, vectors, arrays, ids=None, rerank=50, **params):
+        if 'int8_codes' not in arrays:
+            return None
+        return cls.from_parts(vectors, arrays['int8_codes'], arrays['int8_scale'], ids=ids, rerank=rerank)
+
+    def to_arrays(self):
+        return {'int8_codes': self.codes, 'int8_scale': self.scale}
+
+    def _quantize(self, vectors, ids, rerank):
+        self._setup(vectors, ids, rerank)
+        chunks = range(0, len(vectors), self.chunk_size)
+
+        max_abs = np.zeros(vectors.shape[1], dtype=np.float32)
+        for start in chunks:
+            np.maximum(max_abs, np.abs(vectors[start:start + self.chunk_size]).max(axis=0), out=max_abs)
+        max_abs[max_abs == 0] = 1.0
+        self.scale = max_abs / 127
+
+        self.codes = np.empty(vectors.shape, dtype=np.int8)
+        for start in chunks:
+            chunk = np.asarray(vectors[start:start + self.chunk_size]) / self.scale
+            self.codes[start:start + self.chunk_size] = np.clip(np.rint(chunk), -127, 127)
+
+    def approximate_scores(self, query):
+        weights = (query * self.scale).astype(np.float32)
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        # Small blocks converted into one reused float32 buffer stay in cache
+        buffer = np.empty((1024, self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.codes), len(buffer)):
+            block = self.codes[start:start + len(buffer)]
+            np.copyto(buffer[:len(block)], block, casting='unsafe')
+            scores[start:start + len(block)] = buffer[:len(block)] @ weights
+        return scores
+
+
+class PQIndex(QuantizedIndex):
+    """Product quantization: one byte per group of dimensions.
+
+    Vectors are split into `subspaces` equal sub-vectors, and every sub-vector
+    is stored as the uint8 id of the nearest of 256 centroids trained for its
+    subspace. With the default of one subspace per 4 dimensions the codes are
+    16x smaller than float32. Scores are computed from a per-query lookup
+    table of sub-vector/centroid dot products. `codes` is stored subspace-major,
+    shape `(subspaces, rows)`, so each table lookup reads one contiguous row.
+    """
+
+    def __init__(self, vectors, ids=None, subspaces=None, rerank=50, iterations=15, seed=0):
+        self._train(normalize_rows(vectors), ids, subspaces, rerank, iterations, seed)
+
+    @classmethod
+    def from_normalized(cls, vectors, ids=None, subspaces=None, rerank=50, iterations=15, seed=0):
+        """Train on an already L2-normalized matrix (e.g. a memory map) without copying it."""
+        index = cls.__new__(cls)
+        index._train(vectors, ids, subspaces, rerank, iterations, seed)
+        return index
+
+    @classmethod
+    def from_parts(cls, vectors, codebooks, codes, ids=None, rerank=50):
+        index = cls.__new__(cls)
+        index._setup(vectors, ids, rerank)
+        index.codebooks = codebooks
+        index.codes = codes
+        return index
+
+    @classmethod
+    def from_arrays(cls, vectors, arrays, ids=None, rerank=50, **params):
+        if 'pq_codes' not in arrays:
+            return None
+        return cls.from_parts(vectors, arrays['pq_codebooks'], arrays['pq_codes'], ids=ids, rerank=rerank)
+
+    def to_arrays(self):
+        return {'pq_codebooks': self.codebooks, 'pq_codes': self.codes}
+
+    @property
+    def subspaces(self):
+        return len(self.codebooks)
+
+    def _train(self, vectors, ids, subspaces, rerank, iterations, seed):
+        self._setup(vectors, ids, rerank)
+        dimensions = vectors.shape[1]
+        if subspaces is None:
+            subspaces = max(1, dimensions // 4)
+        if dimensions % subspaces:
+            raise ValueError(f"{dimensions} dimensions cannot be split into {subspaces} equal subspaces")
+        width = dimensions // subspaces
+
+        # All subspaces are trained on the same row sample; tiny corpora get fewer centroids
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), 64 * 256)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+        centroid_count = min(256, sample_size)
+
+        self.codebooks = np.empty((subspaces, centroid_count, width), dtype=np.float32)
+        for m in range(subspaces):
+            self.codebooks[m] = kmeans(sample[:, m * width:(m + 1) * width], centroid_count,
+                                       iterations=iterations, seed=seed + m)
+
+        self.codes = np.empty((subspaces, len(vectors)), dtype=np.uint8)
+        for start in range(0, len(vectors), self.chunk_size):
+            chunk = np.asarray(vectors[start:start + self.chunk_size])
+            for m in range(subspaces):
+                self.codes[m, start:start + self.chunk_size] = assign_clusters(
+                    chunk[:, m * width:(m + 1) * width], self.codebooks[m], spherical=False
+                )
+
+    def approximate_scores(self, query):
+        table = np.einsum('mkw,mw->mk', self.codebooks, query.reshape(self.subspaces, -1))
+        scores = np.zeros(self.codes.shape[1], dtype=np.float32)
+        for m in range(self.subspaces):
+            scores += np.take(table[m], self.codes[m])
+        return scores
+
+
+INDEX_CLASSES = {
+    'flat': BruteForceIndex,
+    'ivf': IVFIndex,
+    'int8': Int8Index,
+    'pq': PQIndex,
+}
+
+
+def create_index(vectors, backend='flat', ids=None, normalized=False, **params):
+    """Build a `backend` index over `vectors`.
+
+    With `normalized=True` the rows must already have unit norm and are used
+    as is, so memory-mapped matrices are not copied.
+    """
+    if backend not in INDEX_CLASSES:
+        raise ValueError(f"Unknown vector index backend {backend!r}; expected one of {INDEX_BACKENDS}")
+    index_class = INDEX_CLASSES[backend]
+    if normalized:
+        return index_class.from_normalized(vectors, ids=ids, **params)
+    return index_class(vectors, ids=ids, **params)